@@ -0,0 +1,309 @@
+# Copyright 2025 Facundo Batista
+# All Rights Reserved
+# Licensed under Apache 2.0
+
+"""Micro benchmarks of the conversion hot paths, using synthetic notebooks.
+
+Each case is run several times and the best and median times are reported; results can be
+saved to a JSON file and compared against a previous one, to spot regressions between commits.
+
+Usage: python3 benchmarks/hotpaths.py [--repeat N] [--output FILE] [--compare FILE] [CASE ...]
+
+SVG images are not really converted (inkscape is not needed): the conversions are put in the
+cache beforehand, so what is measured is only jupynotex's own work.
+"""
+
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import pathlib
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = pathlib.Path(__file__).parent.parent.absolute()
+sys.path.insert(0, str(PROJECT_DIR))
+
+import jupynotex  # NOQA (needs the path set above)
+
+# some text with escape codes, as produced by many tools
+ANSI_LINE = "\x1b[1mEpoch {idx}\x1b[0m: loss=\x1b[32m0.{idx:04d}\x1b[0m acc=0.9 lr=1e-4 " * 3
+
+
+def _stream_output(lines):
+    text = [ANSI_LINE.format(idx=x) + "\n" for x in range(lines)]
+    return {'output_type': 'stream', 'text': text}
+
+
+def _error_output(frames):
+    traceback = ['\x1b[0;31m' + '-' * 75 + '\x1b[0m']
+    for idx in range(frames):
+        traceback.append(
+            f'\x1b[0;32mFile /some/path/module_{idx}.py:{idx}\x1b[0m, in \x1b[0;36mfunc_{idx}'
+            f'\x1b[0m\n\x1b[0;32m----> {idx}\x1b[0m result = func_{idx + 1}(value)\n')
+    traceback.append('\x1b[0;31mValueError\x1b[0m: something went wrong')
+    return {'output_type': 'error', 'ename': 'ValueError', 'evalue': '', 'traceback': traceback}
+
+
+def _png_output(size, seed):
+    rnd = random.Random(seed)
+    content = bytes(rnd.getrandbits(8) for _ in range(size))
+    return {
+        'output_type': 'display_data',
+        'data': {'image/png': base64.b64encode(content).decode('ascii'), 'text/plain': ['fig']},
+    }
+
+
+def _svg_output(idx):
+    svg = f'<svg xmlns="http://www.w3.org/2000/svg"><circle r="{idx}"/></svg>'
+    return {'output_type': 'display_data', 'data': {'image/svg+xml': [svg]}}
+
+
+def build_notebook(path, cells, outputs_factory):
+    """Write a notebook with the indicated quantity of cells, with the outputs from the factory."""
+    nb_cells = []
+    for idx in range(cells):
+        nb_cells.append({
+            'cell_type': 'code',
+            'source': [f'value_{idx} = compute({idx}, "text with _ and # and {{}}")\n'] * 5,
+            'outputs': outputs_factory(idx),
+        })
+        if idx % 5 == 0:
+            nb_cells.append({'cell_type': 'markdown', 'source': [f'# Section {idx}']})
+    content = {'cells': nb_cells, 'metadata': {'language_info': {'name': 'python'}}}
+    path.write_text(json.dumps(content))
+    return path
+
+
+def prime_svg_cache(nb):
+    """Put fake conversions of all the notebook's SVGs in the cache (for the detected tool)."""
+    cache = jupynotex.DiskCache(jupynotex._cache_dir())
+    key_parts = jupynotex._svg_converter(None).key_parts
+    for cell in nb._cells:
+        for item in cell.get('outputs', []):
+            svg = item.get('data', {}).get('image/svg+xml')
+            if svg is not None:
+                raw_svg = ''.join(svg).encode('utf8')
+                key = cache.build_key(raw_svg, *key_parts)
+                cache.path_for(key, '.pdf').write_bytes(b"%PDF fake")
+
+
+class Cases:
+    """All the benchmark cases: each method returns the function to measure."""
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+
+    def _notebook(self, name, cells, outputs_factory, config=None):
+        path = self.workdir / f"{name}.ipynb"
+        if not path.exists():
+            build_notebook(path, cells, outputs_factory)
+        return path, jupynotex.Notebook(path, dict(config or {}))
+
+    def case_init_200_text_cells(self):
+        path, _ = self._notebook("text", 200, lambda idx: [_stream_output(20)])
+        return lambda: jupynotex.Notebook(path, {})
+
+    def case_init_images_notebook(self):
+        path, _ = self._notebook(
+            "images", 40, lambda idx: [_png_output(100_000, idx) for _ in range(3)])
+        return lambda: jupynotex.Notebook(path, {})
+
+    def case_parse_cells_open_range_20k(self):
+        _, nb = self._notebook("many", 20_000, lambda idx: [])
+        return lambda: nb.parse_cells("1-")
+
+    def case_parse_cells_mixed_20k(self):
+        _, nb = self._notebook("many", 20_000, lambda idx: [])
+        return lambda: nb.parse_cells("1-5000i, 5001-10000o, 10001-, output-image-size=5mm")
+
+    def case_proc_src_200_cells(self):
+        _, nb = self._notebook("text", 200, lambda idx: [_stream_output(20)])
+        return lambda: [nb._proc_src(cell) for cell in nb._cells]
+
+    def case_proc_out_large_stream(self):
+        _, nb = self._notebook("bigstream", 1, lambda idx: [_stream_output(100_000)])
+        cell = nb._get_cell(1)
+        return lambda: nb._proc_out(cell)
+
+    def case_proc_out_large_stream_wrapped(self):
+        _, nb = self._notebook(
+            "bigstream", 1, lambda idx: [_stream_output(100_000)], {"output-text-limit": "80"})
+        cell = nb._get_cell(1)
+        return lambda: nb._proc_out(cell)
+
+    def case_proc_out_large_stream_elided(self):
+        _, nb = self._notebook(
+            "bigstream", 1, lambda idx: [_stream_output(100_000)], {"output-max-lines": "200"})
+        cell = nb._get_cell(1)
+        return lambda: nb._proc_out(cell)
+
+    def case_proc_out_long_traceback(self):
+        _, nb = self._notebook("traceback", 1, lambda idx: [_error_output(5_000)])
+        cell = nb._get_cell(1)
+        return lambda: nb._proc_out(cell)
+
+    def case_proc_out_many_pngs(self):
+        _, nb = self._notebook(
+            "pngs", 1, lambda idx: [_png_output(20_000, seed) for seed in range(100)])
+        cell = nb._get_cell(1)
+        return lambda: nb._proc_out(cell)
+
+    def case_proc_out_many_svgs(self):
+        _, nb = self._notebook("svgs", 1, lambda idx: [_svg_output(x) for x in range(200)])
+        prime_svg_cache(nb)
+        cell = nb._get_cell(1)
+        return lambda: nb._proc_out(cell)
+
+    def case_process_plain_text_10k_lines(self):
+        lines = [ANSI_LINE.format(idx=x) for x in range(10_000)]
+        return lambda: jupynotex._process_plain_text(lines)
+
+    def case_process_plain_text_10k_lines_wrapped(self):
+        lines = [ANSI_LINE.format(idx=x) for x in range(10_000)]
+        return lambda: jupynotex._process_plain_text(lines, {"output-text-limit": 60})
+
+    def case_process_plain_text_100k_lines(self):
+        lines = [ANSI_LINE.format(idx=x) for x in range(100_000)]
+        return lambda: jupynotex._process_plain_text(lines)
+
+    def case_process_plain_text_100k_lines_wrapped(self):
+        lines = [ANSI_LINE.format(idx=x) for x in range(100_000)]
+        return lambda: jupynotex._process_plain_text(lines, {"output-text-limit": 60})
+
+    def case_process_plain_text_100kb_token_wrapped(self):
+        lines = ["x" * 100_000]
+        return lambda: jupynotex._process_plain_text(lines, {"output-text-limit": 60})
+
+    def case_process_plain_text_1mb_token_wrapped(self):
+        lines = ["x" * 1_000_000]
+        return lambda: jupynotex._process_plain_text(lines, {"output-text-limit": 60})
+
+    def case_latex_escape_1mb_special(self):
+        text = "Some text with specials: & % $ # _ { } ~ ^ \\ and more. " * 20_000
+        return lambda: jupynotex.latex_escape(text)
+
+    def case_latex_escape_1mb_plain(self):
+        text = "Some plain text without any special character at all, ok. " * 20_000
+        return lambda: jupynotex.latex_escape(text)
+
+    def case_latex_escape_10mb_sparse(self):
+        text = "A regular output line, with some_name and 10% in it, nothing else here. " * 140_000
+        return lambda: jupynotex.latex_escape(text)
+
+    def case_latex_escape_10mb_plain(self):
+        text = "Some plain text without any special character at all, ok. " * 200_000
+        return lambda: jupynotex.latex_escape(text)
+
+    def case_main_all_cells(self):
+        path, _ = self._notebook(
+            "mixed", 100,
+            lambda idx: [_stream_output(50), _error_output(20), _png_output(5_000, idx)])
+
+        def _main():
+            # a fresh cache each time, otherwise all the cells would be reused
+            with tempfile.TemporaryDirectory() as cache_dir:
+                os.environ["JUPYNOTEX_CACHE_DIR"] = cache_dir
+                with contextlib.redirect_stdout(io.StringIO()):
+                    jupynotex.main(path, "1-", {})
+        return _main
+
+    def case_main_all_cells_4_workers(self):
+        path, _ = self._notebook(
+            "mixed", 100,
+            lambda idx: [_stream_output(50), _error_output(20), _png_output(5_000, idx)])
+
+        def _main():
+            with tempfile.TemporaryDirectory() as cache_dir:
+                os.environ["JUPYNOTEX_CACHE_DIR"] = cache_dir
+                with contextlib.redirect_stdout(io.StringIO()):
+                    jupynotex.main(path, "1-", {"render-workers": "4"})
+        return _main
+
+    def case_main_all_cells_cached(self):
+        path, _ = self._notebook(
+            "mixed", 100,
+            lambda idx: [_stream_output(50), _error_output(20), _png_output(5_000, idx)])
+
+        def _main():
+            with contextlib.redirect_stdout(io.StringIO()):
+                jupynotex.main(path, "1-", {})
+        _main()  # warm up the cache
+        return _main
+
+
+def measure(func, repeat):
+    """Run the function several times, return the best and median times."""
+    times = []
+    for _ in range(repeat):
+        tini = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - tini)
+    return {"best": min(times), "median": statistics.median(times)}
+
+
+def _git_commit():
+    try:
+        proc = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_DIR, capture_output=True,
+            text=True)
+    except OSError:
+        return
+    return proc.stdout.strip() or None
+
+
+def main():
+    all_cases = sorted(name[5:] for name in dir(Cases) if name.startswith("case_"))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("cases", nargs="*", help=f"Which cases to run (from {all_cases}).")
+    parser.add_argument("--repeat", type=int, default=5, help="How many times to run each.")
+    parser.add_argument("--output", type=pathlib.Path, help="Save the results in this file.")
+    parser.add_argument("--compare", type=pathlib.Path, help="Compare with previous results.")
+    args = parser.parse_args()
+
+    selected = args.cases or all_cases
+    unknown = set(selected) - set(all_cases)
+    if unknown:
+        parser.error(f"Unknown cases: {sorted(unknown)}")
+
+    previous = {}
+    if args.compare:
+        previous = json.loads(args.compare.read_text())["timings"]
+
+    timings = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = pathlib.Path(workdir)
+        os.environ["JUPYNOTEX_CACHE_DIR"] = str(workdir / "cache")
+        jupynotex.DEFAULT_IMAGE_DIR = str(workdir / "images")
+        cases = Cases(workdir)
+        for name in selected:
+            func = getattr(cases, "case_" + name)()
+            os.environ["JUPYNOTEX_CACHE_DIR"] = str(workdir / "cache")
+            timings[name] = result = measure(func, args.repeat)
+
+            line = f"{name:<45} {result['best'] * 1000:10.2f} ms"
+            if name in previous:
+                ratio = result['best'] / previous[name]['best']
+                line += f"   ({ratio:.2f}x the previous)"
+            print(line)
+
+    if args.output:
+        results = {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "timings": timings,
+        }
+        args.output.write_text(json.dumps(results, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+# Copyright 2025 Facundo Batista
+# All Rights Reserved
+# Licensed under Apache 2.0
+
+"""Measure the startup cost of jupynotex, checking it against a budget.
+
+Two things are measured:
+
+- the import time of the module (using Python's `-X importtime`), and
+- the wall clock time of the whole command line (as called from the .sty) rendering a trivial
+  notebook, minus the time of the bare Python interpreter startup.
+
+Usage: python3 benchmarks/startup.py [--runs N]
+
+It exits with error if any of the budgets is exceeded.
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_DIR = pathlib.Path(__file__).parent.parent.absolute()
+
+# the budgets, in milliseconds
+IMPORT_BUDGET = 50
+CLI_BUDGET = 100
+
+
+def _run_env(cache_dir):
+    """Build the environment to run the measured processes."""
+    env = dict(os.environ, JUPYNOTEX_CACHE_DIR=cache_dir, PYTHONPATH=str(PROJECT_DIR))
+    env.pop("PYTHONDONTWRITEBYTECODE", None)  # as in a normal run, use the bytecode cache
+    return env
+
+
+def measure_import(env, runs):
+    """Return the median time (in ms) to import the module, and the slowest modules imported."""
+    cmd = [sys.executable, "-X", "importtime", "-c", "import jupynotex"]
+    subprocess.run(cmd, env=env, capture_output=True)  # warm up, also the bytecode cache
+
+    totals = []
+    for _ in range(runs):
+        proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+        # the modules imported by another one are listed before it, one level deeper
+        dependencies = []
+        for line in proc.stderr.splitlines():
+            m = re.match(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)", line)
+            if not m:
+                continue
+            cumulative, indent, name = m.groups()
+            cumulative = int(cumulative) / 1000
+            if indent:
+                if len(indent) == 2:
+                    dependencies.append((name, cumulative))
+                continue
+            if name == "jupynotex":
+                totals.append(cumulative)
+                break
+            dependencies = []
+
+    slowest = sorted(dependencies, key=lambda item: -item[1])[:5]
+    return statistics.median(totals), slowest
+
+
+def _wall_clock(cmd, env, cwd, runs):
+    """Return the median wall clock time (in ms) of running the command."""
+    subprocess.run(cmd, env=env, cwd=cwd, capture_output=True)  # warm up
+    times = []
+    for _ in range(runs):
+        tini = time.perf_counter()
+        subprocess.run(cmd, env=env, cwd=cwd, capture_output=True, check=True)
+        times.append((time.perf_counter() - tini) * 1000)
+    return statistics.median(times)
+
+
+def measure_cli(env, workdir, runs):
+    """Return the median time (in ms) of the command line over a bare interpreter."""
+    import jupynotex
+
+    notebook = {
+        'cells': [{
+            'cell_type': 'code',
+            'source': ['print("hello")'],
+            'outputs': [{'output_type': 'stream', 'text': ['hello']}],
+        }],
+        'metadata': {'language_info': {'name': 'python'}},
+    }
+    (workdir / "trivial.ipynb").write_text(json.dumps(notebook))
+
+    options = [""] * len(jupynotex.CMDLINE_OPTION_NAMES)
+    cli_cmd = [sys.executable, "-m", "jupynotex", "client", "trivial.ipynb", "1", *options]
+    bare_cmd = [sys.executable, "-c", "pass"]
+    cli_time = _wall_clock(cli_cmd, env, workdir, runs)
+    bare_time = _wall_clock(bare_cmd, env, workdir, runs)
+    return cli_time - bare_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20, help="How many times to run each.")
+    args = parser.parse_args()
+
+    sys.path.insert(0, str(PROJECT_DIR))
+    with tempfile.TemporaryDirectory() as tempdir:
+        tempdir = pathlib.Path(tempdir)
+        env = _run_env(str(tempdir / "cache"))
+
+        import_time, slowest = measure_import(env, args.runs)
+        cli_time = measure_cli(env, tempdir, args.runs)
+
+    print(f"Import time:   {import_time:6.1f} ms  (budget {IMPORT_BUDGET} ms)")
+    for name, elapsed in slowest:
+        print(f"    {name:<20} {elapsed:6.1f} ms")
+    print(f"CLI overhead:  {cli_time:6.1f} ms  (budget {CLI_BUDGET} ms)")
+
+    if import_time > IMPORT_BUDGET or cli_time > CLI_BUDGET:
+        print("Budget exceeded!")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
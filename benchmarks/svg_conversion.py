@@ -0,0 +1,97 @@
+# Copyright 2025 Facundo Batista
+# All Rights Reserved
+# Licensed under Apache 2.0
+
+"""Compare the throughput of the SVG converters installed, and the conversion modes.
+
+Each converter converts the images one by one and in batch (only inkscape really supports
+that, converting all of them with a single process). The SVG images found in the notebooks
+(by default, the examples) are replicated (slightly changed so they are not deduplicated)
+to have a meaningful quantity, and each mode runs with an empty cache.
+
+Usage: python3 benchmarks/svg_conversion.py [NOTEBOOK ...] [--copies N]
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent))
+
+import jupynotex  # NOQA (needs the path set above)
+
+DEFAULT_NOTEBOOKS = sorted((pathlib.Path(__file__).parent.parent / "example").glob("*.ipynb"))
+
+
+def collect_svgs(notebook_paths, copies):
+    """Get all the SVGs in the notebooks, replicated."""
+    svgs = []
+    for notebook_path in notebook_paths:
+        nb_data = json.loads(notebook_path.read_text())
+        for cell in nb_data['cells']:
+            for item in cell.get('outputs', []):
+                data = item.get('data', {})
+                if 'image/svg+xml' in data:
+                    svgs.append(''.join(data['image/svg+xml']))
+    return [f"{svg}<!-- copy {idx} -->".encode("utf8") for idx in range(copies) for svg in svgs]
+
+
+def individually(raw_svgs, converter_name):
+    """Convert each image on its own."""
+    for raw_svg in raw_svgs:
+        jupynotex._convert_svg(raw_svg, converter_name)
+
+
+def batched(raw_svgs, converter_name):
+    """Convert all the images at once (if the converter supports it)."""
+    jupynotex._convert_svgs_batch(raw_svgs, converter_name)
+
+
+def measure(func, raw_svgs, converter_name):
+    """Run the conversion with a fresh cache, return the elapsed time and images converted."""
+    cache_dir = tempfile.mkdtemp(prefix="jupynotex-bench-")
+    os.environ["JUPYNOTEX_CACHE_DIR"] = cache_dir
+    try:
+        tini = time.monotonic()
+        func(raw_svgs, converter_name)
+        elapsed = time.monotonic() - tini
+        converted = len(list(pathlib.Path(cache_dir).glob("*/*.pdf")))
+        return elapsed, converted
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("notebooks", type=pathlib.Path, nargs="*", default=DEFAULT_NOTEBOOKS)
+    parser.add_argument("--copies", type=int, default=20, help="How many times to replicate.")
+    args = parser.parse_args()
+
+    converters = [
+        name for name, converter in jupynotex.SVG_CONVERTERS.items() if converter.available()]
+    if not converters:
+        print("No SVG converter is installed, nothing to measure")
+        sys.exit(1)
+
+    raw_svgs = collect_svgs(args.notebooks, args.copies)
+    if not raw_svgs:
+        print(f"No SVG images found in {', '.join(str(path) for path in args.notebooks)}")
+        sys.exit(1)
+
+    print(f"Converting {len(raw_svgs)} SVGs from {len(args.notebooks)} notebook(s)")
+    for converter_name in converters:
+        for mode, func in [("individually", individually), ("batched", batched)]:
+            elapsed, converted = measure(func, raw_svgs, converter_name)
+            name = f"{converter_name} {mode}"
+            print(
+                f"{name:>25}: {elapsed:8.3f}s total, {len(raw_svgs) / elapsed:8.1f} images/s "
+                f"({converted} converted)")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,17 +4,18 @@
 
 """Convert a jupyter notebook into latex for inclusion in documents."""
 
-import argparse
-import base64
+# only the modules needed in every run are imported here, the rest of the machinery is
+# imported where it's used, to keep the startup fast (this runs once per included notebook)
+import functools
+import hashlib
 import json
+import os
 import pathlib
 import re
-import subprocess
 import sys
-import tempfile
-import textwrap
-import traceback
-from dataclasses import dataclass
+import time
+from collections import namedtuple
+from collections.abc import Sequence
 
 # message to help people to report potential problems
 REPORT_MSG = """
@@ -34,6 +35,13 @@ HIGHLIGHTERS = {
     None: (VERBATIM_BEGIN, VERBATIM_END),
 }
 
+# the backends to highlight the source of code cells: minted runs Pygments from LaTeX for each
+# block, while with 'pygments' the code is highlighted here and included already colored
+HIGHLIGHTER_BACKENDS = ("minted", "pygments")
+
+# the options for the fancyvrb environment produced when highlighting with Pygments
+PYGMENTS_VERBATIM_OPTIONS = r"fontsize=\footnotesize"
+
 # the different formats to be used when error or all ok
 _style_formats = [
     # text background color
@@ -53,6 +61,64 @@ FORMAT_OK = ",".join(_style_formats)
 FORMAT_ERROR = "colback=red!5!white,colframe=red!75!"
 
 
+# how the SVG images are indicated in the (raw) outputs of a cell
+SVG_MIMETYPE = b'"image/svg+xml"'
+
+# the flags used to convert SVGs to PDF (part of the cache key, so results are redone if changed)
+SVG_TO_PDF_FLAGS = ['--export-text-to-path', '--export-type=pdf']
+
+# the same conversion but expressed as inkscape actions, for when it's used in shell mode
+SVG_TO_PDF_ACTIONS = ['export-text-to-path', 'export-type:pdf']
+
+# the flags used to convert SVGs to PDF with rsvg-convert
+RSVG_TO_PDF_FLAGS = ['--format=pdf']
+
+# the maximum size of the cache, if not configured; when exceeded, the least recently used
+# artifacts are removed until it's down to a fraction of it (so it's not pruned on every run)
+DEFAULT_CACHE_MAX_SIZE = "1G"
+CACHE_PRUNE_RATIO = 0.8
+
+# the cache's size is tracked adding what each run writes, and the whole cache is scanned
+# only when that exceeds the maximum, or after this many seconds (to correct any drift)
+CACHE_RESCAN_INTERVAL = 24 * 60 * 60
+
+# the multipliers for the suffixes of sizes
+SIZE_SUFFIXES = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+# where images are stored to be included, if not configured (relative to the LaTeX run)
+DEFAULT_IMAGE_DIR = "jupynotex-images"
+
+# the LaTeX units that are an absolute size, and how many of each are in an inch
+TEX_UNITS_PER_INCH = {"in": 1, "cm": 2.54, "mm": 25.4, "pt": 72.27, "bp": 72, "pc": 72.27 / 12}
+TEX_SIZE_RE = re.compile(r"\s*(\d+(?:\.\d*)?|\.\d+)\s*(in|cm|mm|pt|bp|pc)\s*$")
+
+# the size of the pieces in which the base64 encoded images are decoded (in characters)
+BASE64_CHUNK_SIZE = 64 * 1024
+
+# the whitespace that may be in the base64 encoded images (e.g. line breaks)
+BASE64_WHITESPACE = b" \t\r\n"
+
+# images with more colors than this are considered photographic (so better stored as JPEG)
+PHOTO_MIN_COLORS = 16384
+
+# where the precompiled fragments are stored (relative to the LaTeX run, where the .sty looks)
+FRAGMENTS_DIR = pathlib.Path("jupynotex-fragments")
+
+# a \jupynotex call in LaTeX sources, with the optional cells spec and the notebook
+JUPYNOTEX_CALL_RE = re.compile(r"\\jupynotex\s*(?:\[([^\]]*)\])?\s*\{([^}]*)\}")
+
+# notebooks from this size are loaded through their (cached) index, not parsing them fully
+PARSED_CACHE_MIN_SIZE = 1024 * 1024
+
+# the tokens needed to find the structure of a JSON document: strings and delimiters
+_JSON_TOKEN_RE = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"|[{}\[\]:]')
+
+# a rule in the dependency file, for the files used by a \jupynotex call
+DEPENDENCY_RULE_RE = re.compile(r"^(.*?): (.*)  # jupynotex call: (.*)$")
+
+# each file in the prerequisites of a Make rule (where spaces are escaped)
+MAKE_WORD_RE = re.compile(r"(?:\\.|[^\s\\])+")
+
 # a little mark to put in the continuation line(s) when text is wrapped
 WRAP_MARK = "↳"
 
@@ -67,18 +133,218 @@ CMDLINE_OPTION_NAMES = {
         "Same than cells-id-template but only applies to the first cell of each file; "
         "defaults to the value of cells-id-template"
     ),
+    "image-dir": (
+        "The directory where images are stored to be included in the document; "
+        f"defaults to '{DEFAULT_IMAGE_DIR}'"
+    ),
+    "svg-workers": (
+        "How many SVG images to convert at the same time; defaults to the quantity of CPUs"
+    ),
+    "timing": (
+        "Report the time spent in each phase to stderr if '1'; if it's a filename, also "
+        "append the report there in JSON (overrides the JUPYNOTEX_TIMING environment variable)"
+    ),
+    "output-max-lines": (
+        "The maximum quantity of lines to show for each text output; if exceeded, only its first "
+        "and last lines are shown"
+    ),
+    "output-max-bytes": (
+        "The maximum size in bytes of each text output; if exceeded, only its first and last "
+        "lines are shown"
+    ),
+    "image-dpi": (
+        "The resolution for PNG images with an absolute output-image-size; bigger ones are "
+        "downscaled (needs Pillow)"
+    ),
+    "image-jpeg-quality": (
+        "If indicated, photographic PNG images are stored as JPEG with this quality, when "
+        "smaller (needs Pillow)"
+    ),
+    "dependency-file": (
+        "A file to update with the notebooks and images used, in Make format; the target is "
+        "the PDF named as the file (e.g. 'doc.d' for 'doc.pdf')"
+    ),
+    "highlighter": (
+        "How to highlight the source of code cells: 'minted' (the default) or 'pygments' (done "
+        "here, so LaTeX does not need to run anything for it)"
+    ),
+    "mimetype-priority": (
+        "The mimetypes to prefer for the outputs, in order, separated by commas (e.g. "
+        "'image/png,image/svg+xml'); the rest are used in the default order"
+    ),
+    "svg-converter": (
+        "The tool to convert SVG images to PDF: 'inkscape', 'rsvg-convert' or 'cairosvg'; "
+        "defaults to the first one installed, in that order"
+    ),
+    "render-workers": (
+        "How many processes render the cells at the same time; defaults to 1 (one after the "
+        "other, in this process)"
+    ),
 }
 
+# the options that do not change how cells are rendered (so they don't affect its cache)
+RENDER_NEUTRAL_OPTIONS = {"svg-workers", "timing", "dependency-file", "render-workers"}
+
+# how many cells each worker may have rendered ahead of the one being written (when
+# rendering concurrently), so memory doesn't grow with the quantity of cells
+RENDER_AHEAD_PER_WORKER = 2
+
+# how many loaded notebooks the render daemon keeps in memory, and how many rendered cells
+# for each of them (the least recently used ones are dropped)
+DAEMON_MAX_NOTEBOOKS = 32
+DAEMON_MAX_RENDERED_CELLS = 1000
+
+# how many seconds to wait for the render daemon (in each step of the communication) before
+# giving up and rendering without it, so a stuck or busy daemon never blocks LaTeX
+DAEMON_TIMEOUT = 60
+
+
+class _NoPhase:
+    """A phase that does not measure anything, used when timing is disabled."""
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class _Phase:
+    """A phase being measured."""
 
-@dataclass(order=True, eq=True, frozen=True)
-class CellSelection:
+    def __init__(self, events, name):
+        self.events = events
+        self.name = name
+
+    def __enter__(self):
+        self.tini = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        # appending is atomic, so phases can be measured from different threads
+        self.events.append((self.name, time.perf_counter() - self.tini))
+
+
+class PhaseTimer:
+    """Measure the wall time of the different phases of the processing, if enabled."""
+
+    def __init__(self):
+        self.enabled = False
+        self.json_path = None
+        self.events = []
+
+    def start(self, setting):
+        """Start timing according to the setting: '1' (only stderr), a filename, or disabled."""
+        self.events = []
+        self.enabled = bool(setting)
+        self.json_path = None if setting in ("", "1", None) else pathlib.Path(setting)
+
+    def phase(self, name):
+        """Return a context manager to measure a phase."""
+        if not self.enabled:
+            return _NO_PHASE
+        return _Phase(self.events, name)
+
+    def summary(self):
+        """Return each phase with its quantity of calls and total time, in order of appearance."""
+        phases = {}
+        for name, elapsed in self.events:
+            calls, total = phases.get(name, (0, 0))
+            phases[name] = (calls + 1, total + elapsed)
+        return [(name, calls, total) for name, (calls, total) in phases.items()]
+
+    def report(self, notebook_path, total, extra_info):
+        """Write the summary to stderr (so it ends in the LaTeX log) and to the JSON file."""
+        if not self.enabled:
+            return
+
+        summary = self.summary()
+        print(f"jupynotex timing for {notebook_path} (total {total * 1000:.1f} ms):",
+              file=sys.stderr)
+        for name, calls, elapsed in summary:
+            calls_info = f"(x{calls})" if calls > 1 else ""
+            print(f"    {name:<40} {calls_info:>7} {elapsed * 1000:10.1f} ms", file=sys.stderr)
+        for key, value in extra_info.items():
+            print(f"    {key}: {value}", file=sys.stderr)
+
+        if self.json_path is not None:
+            report = {
+                "notebook": str(notebook_path),
+                "total": total,
+                "phases": [
+                    {"name": name, "calls": calls, "total": elapsed}
+                    for name, calls, elapsed in summary],
+                **extra_info,
+            }
+            with self.json_path.open("at", encoding="utf8") as fh:
+                fh.write(json.dumps(report) + "\n")
+
+
+_NO_PHASE = _NoPhase()
+TIMER = PhaseTimer()
+
+
+class CellSelection(namedtuple("CellSelection", "index partial", defaults=("a",))):
     """The selection of a cell.
 
     Its number (`index`) and an indication if what part is used: (A)ll, only the (I)nput, or only
     the (O)utput.
     """
-    index: int
-    partial: str = "a"
+    __slots__ = ()
+
+
+class CellSelections(Sequence):
+    """The selected cells, kept as sorted and disjoint intervals of cells with the same part.
+
+    The `CellSelection` of each cell is produced lazily (so selecting all the cells of a huge
+    notebook is cheap), and the whole sequence compares equal to a list of them.
+    """
+    __slots__ = ("intervals", "_offsets", "_length")
+
+    def __init__(self, intervals):
+        self.intervals = intervals  # (first, last, partial)
+
+        # the position in the sequence of the first cell of each interval, to index it
+        self._offsets = []
+        position = 0
+        for first, last, _ in intervals:
+            self._offsets.append(position)
+            position += last - first + 1
+        self._length = position
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for first, last, partial in self.intervals:
+            for index in range(first, last + 1):
+                yield CellSelection(index, partial)
+
+    def __getitem__(self, position):
+        if isinstance(position, slice):
+            return [self[pos] for pos in range(*position.indices(self._length))]
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError("cell selection index out of range")
+
+        import bisect
+
+        interval_idx = bisect.bisect_right(self._offsets, position) - 1
+        first, _, partial = self.intervals[interval_idx]
+        return CellSelection(first + position - self._offsets[interval_idx], partial)
+
+    def __eq__(self, other):
+        if isinstance(other, CellSelections):
+            return self.intervals == other.intervals
+        if isinstance(other, (list, tuple)):
+            return len(other) == self._length and all(
+                mine == theirs for mine, theirs in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.intervals!r})"
 
 
 LATEX_ESCAPE = [
@@ -96,12 +362,804 @@ LATEX_ESCAPE = [
 
 
 def latex_escape(text):
-    """Escape some chars in latex."""
-    for src, dst in LATEX_ESCAPE:
+    """Escape some chars in latex.
+
+    Looking for a char is much faster than replacing it (which copies the whole text), so
+    only the specials present in the text are replaced, and if none the text is returned
+    untouched.
+    """
+    present = [(src, dst) for src, dst in LATEX_ESCAPE if src in text]
+    for src, dst in present:
         text = text.replace(src, dst)
     return text
 
 
+def _cache_dir():
+    """Return the directory to persist cached artifacts between runs.
+
+    It can be forced with the JUPYNOTEX_CACHE_DIR environment variable, otherwise it's a
+    'jupynotex' directory in the user's cache directory (following XDG).
+    """
+    forced_dir = os.environ.get("JUPYNOTEX_CACHE_DIR")
+    if forced_dir:
+        return pathlib.Path(forced_dir)
+    xdg_cache = os.environ.get("XDG_CACHE_HOME")
+    base_dir = pathlib.Path(xdg_cache) if xdg_cache else pathlib.Path.home() / ".cache"
+    return base_dir / "jupynotex"
+
+
+def _parse_size(text):
+    """Parse a size in bytes, optionally with a suffix (e.g. '500M')."""
+    text = text.strip().upper().removesuffix("B")
+    suffix = text[-1:] if text[-1:] in SIZE_SUFFIXES else ""
+    value = float(text[:len(text) - len(suffix)])
+    if value < 0:
+        raise ValueError("Size must not be negative.")
+    return int(value * SIZE_SUFFIXES[suffix])
+
+
+def _format_size(size):
+    """Format a size in bytes for humans."""
+    for suffix in ("", "K", "M", "G"):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        suffix = "T"
+    return f"{size:.1f} {suffix}B" if suffix else f"{size} B"
+
+
+def _temp_path(path, suffix=".tmp"):
+    """Return a temporary path to write the file before moving it in place.
+
+    It's unique for each process and thread, as they may be writing the same file.
+    """
+    import threading
+
+    return path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}{suffix}")
+
+
+def _write_text_atomically(path, text):
+    """Write the text through a temporary file moved in place, so readers never see it partial."""
+    temp_path = _temp_path(path)
+    try:
+        temp_path.write_text(text, encoding='utf8')
+        os.replace(temp_path, path)
+    except OSError:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+def _cache_max_size():
+    """Return the maximum size of the cache, forced with the JUPYNOTEX_CACHE_MAX_SIZE env var."""
+    return _parse_size(os.environ.get("JUPYNOTEX_CACHE_MAX_SIZE") or DEFAULT_CACHE_MAX_SIZE)
+
+
+# the artifacts that didn't exist when their path was requested in this process (so they
+# may have been created), to account their size in the cache
+_NEW_ARTIFACTS = set()
+
+
+class DiskCache:
+    """A persistent store of artifacts, addressed by a hash of everything that produced them."""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    @staticmethod
+    def build_key(*parts):
+        """Build a key hashing all the received parts (bytes or strings)."""
+        hasher = hashlib.sha256()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode("utf8")
+            # include the length so different splits of the same bytes do not collide
+            hasher.update(len(part).to_bytes(8, "big"))
+            hasher.update(part)
+        return hasher.hexdigest()
+
+    def path_for(self, key, suffix):
+        """Return the path for an artifact (creating its parent dir, if needed)."""
+        path = self.base_dir / key[:2] / (key + suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if not path.exists():
+            _NEW_ARTIFACTS.add(path)
+        return path
+
+    def added_size(self):
+        """Return the size of the artifacts created in this cache since last called."""
+        added = 0
+        for path in list(_NEW_ARTIFACTS):
+            if path.parent.parent != self.base_dir:
+                continue
+            _NEW_ARTIFACTS.discard(path)
+            try:
+                added += path.stat().st_size
+            except OSError:
+                pass  # never created, or already removed
+        return added
+
+    @staticmethod
+    def touch(path):
+        """Mark an artifact as recently used (its modification time is the last use)."""
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # maybe removed by other process, not a problem
+
+    def artifacts(self):
+        """Return the path, size and last use of all the artifacts, oldest used first."""
+        artifacts = []
+        try:
+            subdirs = [entry for entry in os.scandir(self.base_dir) if entry.is_dir()]
+        except OSError:
+            return artifacts
+        for subdir in subdirs:
+            try:
+                entries = list(os.scandir(subdir.path))
+            except OSError:
+                continue  # removed by other process, or not readable
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # removed by other process
+                artifacts.append((entry.path, stat.st_size, stat.st_mtime))
+        artifacts.sort(key=lambda artifact: artifact[2])
+        return artifacts
+
+    def prune(self, max_size, target_size=None):
+        """Remove the least recently used artifacts if the cache is bigger than the max size.
+
+        It's reduced to the target size (by default, the max size). The resulting size is
+        recorded, to know when it needs to be scanned again. Return the quantity of artifacts
+        removed and the bytes freed.
+        """
+        if target_size is None:
+            target_size = max_size
+        artifacts = self.artifacts()
+        total = sum(size for _, size, _ in artifacts)
+
+        removed = freed = 0
+        if total > max_size:
+            for path, size, _ in artifacts:
+                if total - freed <= target_size:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass  # removed by other process
+                except OSError:
+                    continue  # can not be removed (e.g. a read-only cache)
+                removed += 1
+                freed += size
+
+        stats = self._read_stats()
+        stats["size"] = total - freed
+        stats["scanned"] = time.time()
+        self._write_stats(stats)
+        return removed, freed
+
+    def _stats_path(self):
+        return self.base_dir / "stats.json"
+
+    def _read_stats(self):
+        try:
+            return json.loads(self._stats_path().read_text(encoding='utf8'))
+        except (OSError, ValueError):
+            return {}
+
+    def _write_stats(self, stats):
+        try:
+            self.base_dir.mkdir(parents=True, exist_ok=True)
+            _write_text_atomically(self._stats_path(), json.dumps(stats))
+        except OSError:
+            pass  # not critical
+
+    def stats(self):
+        """Return the accumulated hits and misses of the rendered cells."""
+        stats = self._read_stats()
+        return {"hits": stats.get("hits", 0), "misses": stats.get("misses", 0)}
+
+    def record_stats(self, hits, misses, added_size=0):
+        """Add the hits and misses of a run to the accumulated ones (best effort).
+
+        The size of the added artifacts is also added to the cache's size (if known from a
+        previous scan). Return all the stats.
+        """
+        stats = self._read_stats()
+        stats["hits"] = stats.get("hits", 0) + hits
+        stats["misses"] = stats.get("misses", 0) + misses
+        if "size" in stats:
+            stats["size"] += added_size
+        self._write_stats(stats)
+        return stats
+
+
+class ImageStore:
+    """A directory with the images to include, named after a hash of their content.
+
+    This way the same image is written only once, even if it appears several times in one
+    or more notebooks, and always to the same file.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+
+    def _write(self, path, content):
+        """Write the content atomically, so concurrent runs never see a partial image."""
+        import tempfile
+
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_fname = tempfile.mkstemp(dir=self.base_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(content)
+            os.replace(temp_fname, path)
+        except BaseException:
+            os.unlink(temp_fname)
+            raise
+
+    def store(self, content, suffix):
+        """Store the content (if not there already), return its path."""
+        path = self.base_dir / (hashlib.sha256(content).hexdigest() + suffix)
+        if not path.exists():
+            self._write(path, content)
+        return path
+
+    def store_base64(self, encoded, suffix):
+        """Store the content encoded in base64 (if not there already), return its path.
+
+        It's decoded in chunks straight into a temporary file while hashing it, so the whole
+        content is never in memory; then the file is moved to its final name, or discarded
+        if that image was already stored.
+        """
+        import tempfile
+
+        self.base_dir.mkdir(parents=True, exist_ok=True)
+        fd, temp_fname = tempfile.mkstemp(dir=self.base_dir, suffix='.tmp')
+        try:
+            hasher = hashlib.sha256()
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in _base64_decoded_chunks(encoded):
+                    hasher.update(chunk)
+                    fh.write(chunk)
+            path = self.base_dir / (hasher.hexdigest() + suffix)
+            if not path.exists():
+                os.replace(temp_fname, path)
+        finally:
+            if os.path.exists(temp_fname):
+                os.unlink(temp_fname)
+        return path
+
+    def store_file(self, src_path):
+        """Store the file, which is already named after a hash (if not there already).
+
+        Return the path of the stored image.
+        """
+        path = self.base_dir / src_path.name
+        if not path.exists():
+            self._write(path, src_path.read_bytes())
+        return path
+
+
+def _base64_decoded_chunks(encoded):
+    """Decode the base64 text in chunks, generating the decoded bytes of each.
+
+    Only complete groups of four characters are decoded each time (whitespace is ignored),
+    the rest is left for the next chunk.
+    """
+    import binascii
+
+    pending = b""
+    for start in range(0, len(encoded), BASE64_CHUNK_SIZE):
+        piece = encoded[start:start + BASE64_CHUNK_SIZE].encode("ascii")
+        piece = pending + piece.translate(None, BASE64_WHITESPACE)
+        usable = len(piece) - len(piece) % 4
+        pending = piece[usable:]
+        if usable:
+            yield binascii.a2b_base64(memoryview(piece)[:usable])
+    if pending:
+        yield binascii.a2b_base64(pending)  # incomplete, it will fail as the whole would
+
+
+def _target_width(image_size, dpi):
+    """Return the width in pixels of an image shown in that LaTeX size, None if unknown.
+
+    Only absolute sizes can be converted (e.g. not a fraction of the text width).
+    """
+    if not image_size or not dpi:
+        return
+    match = TEX_SIZE_RE.match(image_size)
+    if match is None:
+        return
+    value, unit = match.groups()
+    return max(1, round(float(value) / TEX_UNITS_PER_INCH[unit] * dpi))
+
+
+@functools.lru_cache(maxsize=None)
+def _warn_no_pillow():
+    """Warn (only once) that images can not be optimized."""
+    print("WARNING: Pillow is needed to optimize the images, using them as they are",
+          file=sys.stderr)
+
+
+def _is_photographic(image):
+    """Tell if the image is better stored as JPEG: too many colors and no transparency."""
+    if image.mode not in ("RGB", "RGBA", "L"):
+        return False
+    if image.mode == "RGBA" and image.getchannel("A").getextrema()[0] < 255:
+        return False
+    return image.getcolors(maxcolors=PHOTO_MIN_COLORS) is None
+
+
+def _optimize_png(raw_png, width, jpeg_quality):
+    """Downscale a PNG to the width (if bigger) and re-encode it as JPEG if that's better.
+
+    The result is cached by the image content and those parameters; return its path, or
+    None if the original image should be used (nothing to gain, or Pillow not installed).
+    """
+    cache = DiskCache(_cache_dir())
+    key = cache.build_key(raw_png, str(width), str(jpeg_quality))
+    same_path = cache.path_for(key, '.same')
+    if same_path.exists():
+        cache.touch(same_path)
+        return
+    for suffix in ('.png', '.jpg'):
+        path = cache.path_for(key, suffix)
+        if path.exists():
+            cache.touch(path)
+            return path
+
+    try:
+        from PIL import Image
+    except ImportError:
+        _warn_no_pillow()
+        return
+    import io
+
+    image = Image.open(io.BytesIO(raw_png))
+    content = raw_png
+    if width is not None and image.width > width:
+        height = max(1, round(image.height * width / image.width))
+        resampling = getattr(Image, "Resampling", Image)  # moved in Pillow 9.1
+        image = image.resize((width, height), resampling.LANCZOS)
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG", optimize=True)
+        content = buffer.getvalue()
+
+    suffix = '.png'
+    if jpeg_quality and _is_photographic(image):
+        buffer = io.BytesIO()
+        image.convert("RGB").save(buffer, format="JPEG", quality=jpeg_quality, optimize=True)
+        if len(buffer.getvalue()) < len(content):
+            content = buffer.getvalue()
+            suffix = '.jpg'
+
+    if content is raw_png:
+        # just remember there is nothing to do with this one
+        cache.path_for(key, '.same').touch()
+        return
+
+    # written atomically, as other processes may be using the same cache
+    path = cache.path_for(key, suffix)
+    temp_path = _temp_path(path)
+    temp_path.write_bytes(content)
+    os.replace(temp_path, path)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def _pygments_version():
+    """Return the version of Pygments, None if not installed (warning only once)."""
+    try:
+        import pygments
+    except ImportError:
+        print("WARNING: Pygments is needed to highlight the code, using minted", file=sys.stderr)
+        return
+    return pygments.__version__
+
+
+@functools.lru_cache(maxsize=None)
+def _pygments_style_defs():
+    """Return the lines defining the LaTeX commands used in the code highlighted by Pygments."""
+    from pygments.formatters import LatexFormatter
+
+    return LatexFormatter().get_style_defs().split("\n")
+
+
+def _highlight_source(code, language):
+    """Highlight the code with Pygments, return the lines of a fancyvrb environment.
+
+    The result is cached by the code, its language and the Pygments version, so the same
+    source is not highlighted again in later runs. Return None if Pygments does not know
+    the language.
+    """
+    cache = DiskCache(_cache_dir())
+    key = cache.build_key(code, language, _pygments_version(), PYGMENTS_VERBATIM_OPTIONS)
+    path = cache.path_for(key, '.tex')
+    try:
+        highlighted = path.read_text(encoding='utf8')
+    except FileNotFoundError:
+        pass
+    else:
+        cache.touch(path)
+        return highlighted.split("\n")
+
+    import pygments
+    from pygments.formatters import LatexFormatter
+    from pygments.lexers import get_lexer_by_name
+    from pygments.util import ClassNotFound
+
+    try:
+        lexer = get_lexer_by_name(language)
+    except ClassNotFound:
+        return
+    with TIMER.phase("pygments"):
+        formatter = LatexFormatter(verboptions=PYGMENTS_VERBATIM_OPTIONS)
+        highlighted = pygments.highlight(code, lexer, formatter).rstrip("\n")
+
+    # written atomically, as other processes may be using the same cache
+    temp_path = _temp_path(path)
+    try:
+        temp_path.write_text(highlighted, encoding='utf8')
+        os.replace(temp_path, path)
+    except OSError:
+        pass  # not critical, it will be highlighted again next time
+    return highlighted.split("\n")
+
+
+class _SVGConverter:
+    """A tool to convert SVG images to PDF.
+
+    Each tool defines `convert(svg_path, pdf_path)` to convert an image (the PDF path is a
+    temporary one, moved in place later).
+    """
+
+    # the name to configure it, and what else (besides the image) produces its results
+    name = None
+    key_parts = []
+
+    def available(self):
+        """Tell if the tool is installed."""
+        import shutil
+
+        return shutil.which(self.name) is not None
+
+    def convert_many(self, paths):
+        """Convert several images (SVG and temporary PDF paths) at once, if supported.
+
+        Otherwise do nothing, each image is converted separately later.
+        """
+
+
+class _InkscapeConverter(_SVGConverter):
+    """Convert with inkscape, which also supports converting many images in one process."""
+
+    name = "inkscape"
+    key_parts = SVG_TO_PDF_FLAGS
+
+    def convert(self, svg_path, pdf_path):
+        import subprocess
+
+        cmd = ['inkscape', *SVG_TO_PDF_FLAGS, f'--export-filename={pdf_path}', str(svg_path)]
+        with TIMER.phase("subprocess inkscape"):
+            subprocess.run(cmd)
+
+    def convert_many(self, paths):
+        import subprocess
+
+        commands = []
+        for svg_path, pdf_path in paths:
+            actions = [f'file-open:{svg_path}', *SVG_TO_PDF_ACTIONS]
+            actions.extend([f'export-filename:{pdf_path}', 'export-do', 'file-close'])
+            commands.append(';'.join(actions))
+        commands.append('quit')
+        try:
+            # inkscape's shell output is discarded, as stdout ends up being parsed by LaTeX
+            with TIMER.phase("subprocess inkscape --shell"):
+                subprocess.run(
+                    ['inkscape', '--shell'], input='\n'.join(commands), text=True,
+                    stdout=subprocess.DEVNULL)
+        except (OSError, subprocess.SubprocessError):
+            pass  # all the images will be converted individually
+
+
+class _RsvgConverter(_SVGConverter):
+    """Convert with rsvg-convert (from librsvg), which starts much faster than inkscape."""
+
+    name = "rsvg-convert"
+    key_parts = ["rsvg-convert", *RSVG_TO_PDF_FLAGS]
+
+    def convert(self, svg_path, pdf_path):
+        import subprocess
+
+        cmd = ['rsvg-convert', *RSVG_TO_PDF_FLAGS, f'--output={pdf_path}', str(svg_path)]
+        with TIMER.phase("subprocess rsvg-convert"):
+            subprocess.run(cmd)
+
+
+class _CairoSVGConverter(_SVGConverter):
+    """Convert with the CairoSVG Python module, without running any external program."""
+
+    name = "cairosvg"
+    key_parts = ["cairosvg"]
+
+    def available(self):
+        import importlib.util
+
+        return importlib.util.find_spec("cairosvg") is not None
+
+    def convert(self, svg_path, pdf_path):
+        import cairosvg
+
+        with TIMER.phase("cairosvg"):
+            cairosvg.svg2pdf(url=str(svg_path), write_to=str(pdf_path))
+
+
+# the tools to convert SVG images, in order of preference when none is configured
+SVG_CONVERTERS = {
+    converter.name: converter
+    for converter in (_InkscapeConverter(), _RsvgConverter(), _CairoSVGConverter())
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _detect_svg_converter():
+    """Return the name of the first SVG converter installed (inkscape if none is)."""
+    for name, converter in SVG_CONVERTERS.items():
+        if converter.available():
+            return name
+    return "inkscape"  # it will fail, but reporting what is missing in a familiar way
+
+
+def _svg_converter(name):
+    """Return the SVG converter with that name, or the one detected if not indicated."""
+    return SVG_CONVERTERS[name or _detect_svg_converter()]
+
+
+def _conversion_paths(cache, key):
+    """Return the final PDF path of a conversion, and the temporary SVG and PDF paths to do it.
+
+    The temporary ones are unique (for each process and thread), as other conversions of the
+    same image may be running concurrently; the result is moved in place when finished.
+    """
+    pdf_path = cache.path_for(key, '.pdf')
+    return pdf_path, _temp_path(pdf_path, '.tmp.svg'), _temp_path(pdf_path, '.tmp.pdf')
+
+
+def _finish_conversion(temp_svg_path, temp_pdf_path, pdf_path):
+    """Move the converted PDF in place (if produced), and remove the temporary files."""
+    temp_svg_path.unlink(missing_ok=True)
+    if temp_pdf_path.exists():
+        os.replace(temp_pdf_path, pdf_path)
+
+
+def _convert_svg(raw_svg, converter_name=None):
+    """Transform a SVG to PDF (if not done before), returning the PDF's path.
+
+    The resulting PDFs are cached by the SVG content and the converter used (with its
+    flags), so the converter is not called again for the same image in later runs.
+    """
+    converter = _svg_converter(converter_name)
+    cache = DiskCache(_cache_dir())
+    key = cache.build_key(raw_svg, *converter.key_parts)
+    pdf_path, temp_svg_path, temp_pdf_path = _conversion_paths(cache, key)
+    if pdf_path.exists():
+        cache.touch(pdf_path)
+        return pdf_path
+
+    temp_svg_path.write_bytes(raw_svg)
+    try:
+        converter.convert(temp_svg_path, temp_pdf_path)
+    finally:
+        _finish_conversion(temp_svg_path, temp_pdf_path, pdf_path)
+    return pdf_path
+
+
+def _convert_svgs_batch(raw_svgs, converter_name=None):
+    """Transform several SVGs to PDF, all at once if the converter supports it.
+
+    E.g. all the conversions not done before are sent as actions to an inkscape in shell
+    mode, to pay its startup only once; if that fails for any image (or the converter does
+    not support it), it's converted on its own.
+    """
+    converter = _svg_converter(converter_name)
+    cache = DiskCache(_cache_dir())
+    pending = []
+    for raw_svg in raw_svgs:
+        key = cache.build_key(raw_svg, *converter.key_parts)
+        pdf_path, temp_svg_path, temp_pdf_path = _conversion_paths(cache, key)
+        if not pdf_path.exists():
+            temp_svg_path.write_bytes(raw_svg)
+            pending.append((raw_svg, temp_svg_path, temp_pdf_path, pdf_path))
+    if not pending:
+        return
+
+    try:
+        converter.convert_many([(svg_path, temp_pdf) for _, svg_path, temp_pdf, _ in pending])
+    finally:
+        for _, temp_svg_path, temp_pdf_path, pdf_path in pending:
+            _finish_conversion(temp_svg_path, temp_pdf_path, pdf_path)
+
+    for raw_svg, _, _, pdf_path in pending:
+        if not pdf_path.exists():
+            _convert_svg(raw_svg, converter_name)
+
+
+def _scan_notebook(buffer):
+    """Scan the raw bytes of a notebook building an index of its content.
+
+    Only the structure of the JSON document is followed (skipping over the big strings, like
+    images, without decoding them), to find the metadata, the cells, and the position of each
+    cell's outputs. Return the language and the non-markdown cells; instead of their outputs
+    these have a '_outputs_span' with the start and end positions of them in the buffer.
+    """
+    metadata_span = None
+    cell_spans = []
+    outputs_spans = {}
+    keys = {}  # the last key found in each depth
+    depth = 0
+    in_cells = False
+    last_string = None
+    container_start = {}
+    for match in _JSON_TOKEN_RE.finditer(buffer):
+        position = match.start()
+        char = buffer[position:position + 1]
+        if char == b'"':
+            last_string = (position + 1, match.end() - 1)
+        elif char == b':':
+            keys[depth] = bytes(buffer[last_string[0]:last_string[1]])
+        elif char in b'{[':
+            depth += 1
+            keys[depth] = None
+            container_start[depth] = position
+            if depth == 2 and keys[1] == b'cells' and char == b'[':
+                in_cells = True
+        else:
+            if depth == 2:
+                if keys[1] == b'metadata':
+                    metadata_span = (container_start[depth], position + 1)
+                in_cells = False
+            elif depth == 3 and in_cells:
+                cell_spans.append((container_start[depth], position + 1))
+            elif depth == 4 and in_cells and keys[3] == b'outputs':
+                outputs_spans[len(cell_spans)] = (container_start[depth], position + 1)
+            depth -= 1
+
+    metadata = json.loads(bytes(buffer[metadata_span[0]:metadata_span[1]]))
+    lang = metadata['language_info']['name']
+
+    cells = []
+    for idx, (cell_start, cell_end) in enumerate(cell_spans):
+        outputs_span = outputs_spans.get(idx)
+        if outputs_span is None:
+            raw_cell = bytes(buffer[cell_start:cell_end])
+        else:
+            # decode all the cell except the outputs
+            outputs_start, outputs_end = outputs_span
+            raw_cell = b"".join([
+                buffer[cell_start:outputs_start], b"[]", buffer[outputs_end:cell_end]])
+        cell = json.loads(raw_cell)
+        if cell['cell_type'] == 'markdown':
+            continue
+        if outputs_span is not None:
+            del cell['outputs']
+        cell['_outputs_span'] = outputs_span
+        cells.append(cell)
+    return lang, cells
+
+
+def _file_hash(path, algorithm=hashlib.sha256):
+    """Return the hash of a file (SHA256 by default), reading it in chunks."""
+    hasher = algorithm()
+    with path.open('rb') as fh:
+        for chunk in iter(lambda: fh.read(64 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _load_notebook_index(notebook_path):
+    """Return the notebook's index, from the cache if the notebook didn't change.
+
+    This is how big notebooks are loaded: walking their structure (never holding the whole
+    file in memory), and later materializing only the outputs of the used cells.
+
+    The cached index is trusted if the notebook's size and modification time are the same;
+    if not, the notebook's content hash is checked before building the index again.
+    """
+    cache = DiskCache(_cache_dir())
+    try:
+        index_path = cache.path_for(cache.build_key(str(notebook_path.resolve())), '.index.json')
+    except OSError:
+        index_path = pathlib.Path(os.devnull)  # no cache available, always build the index
+    stat = notebook_path.stat()
+    try:
+        index = json.loads(index_path.read_text(encoding='utf8'))
+    except (OSError, ValueError):
+        index = None
+
+    if index is not None and index['size'] == stat.st_size:
+        if index['mtime_ns'] == stat.st_mtime_ns:
+            cache.touch(index_path)
+            return index['language'], index['cells']
+        content_hash = _file_hash(notebook_path)
+        if index['content_hash'] == content_hash:
+            index['mtime_ns'] = stat.st_mtime_ns
+            _save_index(index_path, index)
+            return index['language'], index['cells']
+    else:
+        content_hash = _file_hash(notebook_path)
+
+    # scan the file through a memory map, so it's never fully loaded in memory
+    import mmap
+
+    with notebook_path.open('rb') as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            lang, cells = _scan_notebook(buffer)
+    index = {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'content_hash': content_hash,
+        'language': lang,
+        'cells': cells,
+    }
+    _save_index(index_path, index)
+    return lang, cells
+
+
+def _save_index(index_path, index):
+    """Save the notebook's index in the cache, if available."""
+    if str(index_path) == os.devnull:
+        return
+    try:
+        _write_text_atomically(index_path, json.dumps(index))
+    except OSError as exc:
+        # not critical, the index will be built again next time
+        print(f"WARNING: could not save the notebook index: {exc!r}", file=sys.stderr)
+
+
+@functools.lru_cache(maxsize=None)
+def _code_version():
+    """Return a hash of this code, so cached renders are not reused if it changes."""
+    return _file_hash(pathlib.Path(__file__))
+
+
+class RenderCache:
+    """The rendered LaTeX (source and output) of cells, persisted between runs.
+
+    The hits and misses are counted, to know how effective it was.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the stored rendering, or None if not there (or its images are missing)."""
+        path = self.cache.path_for(key, '.cell.json')
+        try:
+            entry = json.loads(path.read_text(encoding='utf8'))
+        except (OSError, ValueError):
+            entry = None
+        if entry is None or not all(os.path.exists(image) for image in entry['images']):
+            self.misses += 1
+            return
+        self.hits += 1
+        self.cache.touch(path)
+        return entry['source'], entry['output'], entry['images']
+
+    def put(self, key, source, output, images):
+        """Store a rendering, with the images it uses."""
+        path = self.cache.path_for(key, '.cell.json')
+        entry = {'source': source, 'output': output, 'images': [str(x) for x in images]}
+        try:
+            _write_text_atomically(path, json.dumps(entry))
+        except OSError:
+            pass  # not critical, it will be rendered again next time
+
+
 def _validator_positive_int(value):
     """Validate value is a positive integer."""
     value = value.strip()
@@ -114,30 +1172,219 @@ def _validator_positive_int(value):
     return value
 
 
+def _validator_jpeg_quality(value):
+    """Validate value is a JPEG quality (an integer from 1 to 95)."""
+    value = _validator_positive_int(value)
+    if value is not None and value > 95:
+        raise ValueError("JPEG quality must be from 1 to 95.")
+    return value
+
+
+def _validator_highlighter(value):
+    """Validate value is one of the highlighting backends."""
+    value = value.strip()
+    if not value:
+        return
+
+    if value not in HIGHLIGHTER_BACKENDS:
+        raise ValueError(
+            "Highlighter must be one of: {}.".format(", ".join(HIGHLIGHTER_BACKENDS)))
+    return value
+
+
+def _validator_svg_converter(value):
+    """Validate value is one of the SVG converters."""
+    value = value.strip()
+    if not value:
+        return
+
+    if value not in SVG_CONVERTERS:
+        raise ValueError(
+            "SVG converter must be one of: {}.".format(", ".join(SVG_CONVERTERS)))
+    return value
+
+
+def _validator_mimetypes(value):
+    """Validate value is a list of supported mimetypes (separated by commas or spaces)."""
+    mimetypes = value.replace(",", " ").split()
+    if not mimetypes:
+        return
+
+    supported = [mimetype for mimetype, *_ in ItemProcessor.PROCESSORS]
+    for mimetype in mimetypes:
+        if mimetype not in supported:
+            raise ValueError(
+                "Mimetype not supported: {!r} (use {}).".format(mimetype, ", ".join(supported)))
+    return mimetypes
+
+
+# color escape codes (\u001b plus \[Nm where N are one or more digits, maybe with semicolons)
+ANSI_ESCAPE_RE = re.compile(r"\x1b\[[0-9;]+m")
+
+# escape codes found in the tracebacks
+TRACEBACK_ESCAPE_RE = re.compile(r"\x1b\[\d.*?m")
+
+# the line that replaces the lines not shown from a text output that exceeded the limits
+ELISION_MARK = "[... {} lines not shown ...]"
+
+# options that can be set globally or per cell to limit the text outputs
+TEXT_LIMIT_OPTIONS = ("output-max-lines", "output-max-bytes")
+
+# the whitespace that is shown as a space when wrapping text
+WRAP_WHITESPACE = str.maketrans("\x0b\x0c\r", "   ")
+
+# the first char that is not a space
+NOT_SPACE_RE = re.compile("[^ ]")
+
+
+def _wrap_line(line, limit):
+    """Split a line in parts that are not longer than the limit.
+
+    It's a greedy wrapping for monospaced text: it breaks at spaces (which are dropped around
+    the cuts) and words longer than the limit are split to fill the lines; each part is
+    found searching the text only around the cuts, so it is linear in the line's length.
+    """
+    size = len(line)
+    pos = 0
+    while size - pos > limit:
+        end = pos + limit
+        cut = line.rfind(" ", pos, end + 1)
+        if cut != end:
+            # a word crosses the limit: if it doesn't fit in a line by itself anyway it's split
+            # filling the current line (its length is checked only up to the limit)
+            if cut == -1 or line.find(" ", end, cut + limit + 2) == -1 and size - cut > limit + 1:
+                cut = end
+        part = line[pos:cut].rstrip(" ")
+        if part:
+            yield part
+        match = NOT_SPACE_RE.search(line, cut)
+        if match is None:
+            return
+        pos = match.start()
+    yield line[pos:]
+
+
+def _wrapped_lines(lines, limit):
+    """Wrap the lines that exceed the limit, marking the continuation ones."""
+    for line in lines:
+        if len(line) <= limit:
+            yield line
+            continue
+        first = True
+        for part in _wrap_line(line, limit):
+            yield part if first else f"    {WRAP_MARK} {part}"
+            first = False
+
+
+def _elided_lines(lines, max_lines, max_bytes):
+    """Limit the lines to the indicated quantity and size, showing the first and last ones.
+
+    The first lines are yielded as they come up to the half of the limits; after that
+    only the last ones that fit in the rest of the limits are kept, discarding the
+    previous ones, so at most that quantity of lines is held at any time.
+    """
+    import collections
+    import itertools
+
+    max_lines = max_lines or float("inf")
+    max_bytes = max_bytes or float("inf")
+
+    def _size(line):
+        # the newline is also included; no need to encode if there is no limit in bytes
+        return len(line.encode("utf8")) + 1 if max_bytes != float("inf") else 0
+
+    lines = iter(lines)
+    head_lines = head_bytes = 0
+    for line in lines:
+        size = _size(line)
+        if head_lines + 1 > max_lines / 2 or head_bytes + size > max_bytes / 2:
+            break
+        head_lines += 1
+        head_bytes += size
+        yield line
+    else:
+        return
+    lines = itertools.chain([line], lines)
+
+    tail_max_lines = max_lines - head_lines
+    tail_max_bytes = max_bytes - head_bytes
+    if tail_max_bytes == float("inf"):
+        # only limited by quantity, let the deque discard the lines, numbered to count them
+        tail = collections.deque(zip(itertools.count(1), lines), maxlen=tail_max_lines)
+        omitted = tail[0][0] - 1
+        tail = [line for _, line in tail]
+    else:
+        tail = collections.deque()
+        tail_bytes = 0
+        omitted = 0
+        for line in lines:
+            size = _size(line)
+            tail.append((line, size))
+            tail_bytes += size
+            while len(tail) > tail_max_lines or tail_bytes > tail_max_bytes:
+                _, size = tail.popleft()
+                tail_bytes -= size
+                omitted += 1
+        tail = [line for line, _ in tail]
+
+    if omitted:
+        yield ELISION_MARK.format(omitted)
+    yield from tail
+
+
+def _split_lines(text):
+    """Generate the lines of the text, one by one (without splitting it all at once)."""
+    start = 0
+    end = text.find("\n")
+    while end != -1:
+        yield text[start:end]
+        start = end + 1
+        end = text.find("\n", start)
+    yield text[start:]
+
+
+def _text_lines(lines, expand_whitespace=False):
+    """Generate the lines of a text, without the trailing spaces nor color escape codes.
+
+    The text may come as a single string, or as a series of pieces (each one may have
+    several lines, usually ending in a newline, as in the notebooks). Optionally, tabs
+    and other whitespace are expanded to spaces (as needed for wrapping).
+    """
+    if isinstance(lines, str):
+        lines = _split_lines(lines)
+    for piece in lines:
+        piece = piece.rstrip()
+        for line in _split_lines(piece) if "\n" in piece else (piece,):
+            if "\x1b" in line:
+                line = ANSI_ESCAPE_RE.sub("", line)
+            if expand_whitespace:
+                line = line.expandtabs().translate(WRAP_WHITESPACE)
+            yield line
+
+
 def _process_plain_text(lines, config_options=None):
-    """Wrap a series of lines around a verbatim indication."""
+    """Wrap a series of lines around a verbatim indication.
+
+    The text goes line by line through a pipeline of generators (cleaning, wrapping,
+    eliding), so the whole text is never held in memory apart from the result.
+    """
     if config_options is None:
         config_options = {}
 
     result = []
     result.extend(VERBATIM_BEGIN)
-    for line in lines:
-        line = line.rstrip()
-
-        # clean color escape codes (\u001b plus \[Nm where N are one or more digits)
-        line = re.sub(r"\x1b\[[\d;]+m", "", line)
-
+    if lines:
         # split too long lines
         limit = config_options.get("output-text-limit")
-        if limit and line:
-            firstline, *restlines = textwrap.wrap(line, limit)
-            lines = [firstline]
-            for line in restlines:
-                lines.append(f"    {WRAP_MARK} {line}")
-        else:
-            lines = [line]
-
-        result.extend(lines)
+        text_lines = _text_lines(lines, expand_whitespace=bool(limit))
+        if limit:
+            text_lines = _wrapped_lines(text_lines, limit)
+
+        # show only part of the lines if too many
+        max_lines, max_bytes = (config_options.get(option) for option in TEXT_LIMIT_OPTIONS)
+        if max_lines or max_bytes:
+            text_lines = _elided_lines(text_lines, max_lines, max_bytes)
+        result.extend(text_lines)
     result.extend(VERBATIM_END)
     return result
 
@@ -145,55 +1392,96 @@ def _process_plain_text(lines, config_options=None):
 class ItemProcessor:
     """Process each item according to its type with a (series of) function(s)."""
 
-    def __init__(self, cell_options, config_options):
+    def __init__(self, cell_options, config_options, image_store):
         self.cell_options = cell_options
         self.config_options = config_options
+        self.image_store = image_store
+        self.images = []  # all the images used, in the store
+
+        # the options for text outputs, where the ones from the cell override the global ones
+        self.text_options = dict(config_options)
+        for option in TEXT_LIMIT_OPTIONS:
+            if option in cell_options:
+                self.text_options[option] = _validator_positive_int(cell_options[option])
+
+    @classmethod
+    def select_mimetype(cls, data, priority=None):
+        """Return the mimetype to use from the item's data, and the functions to process it.
+
+        The mimetypes in the priority (if any) are preferred, in that order, over the rest.
+        """
+        processors = cls.PROCESSORS
+        if priority:
+            processors = sorted(processors, key=lambda processor: (
+                priority.index(processor[0]) if processor[0] in priority else len(priority)))
+        for mimetype, *functions in processors:
+            if mimetype in data:
+                return mimetype, functions
+        raise ValueError("Image type not supported: {}".format(data.keys()))
 
     def get_item_data(self, item):
         """Extract item information using different processors."""
 
         data = item['data']
-        for mimetype, *functions in self.PROCESSORS:
-            if mimetype in data:
-                content = data[mimetype]
-                break
-        else:
-            raise ValueError("Image type not supported: {}".format(data.keys()))
-
-        for func in functions:
-            content = func(self, content)
+        mimetype, functions = self.select_mimetype(
+            data, self.config_options.get("mimetype-priority"))
+        content = data[mimetype]
+        with TIMER.phase(f"mimetype {mimetype}"):
+            for func in functions:
+                content = func(self, content)
 
         return content
 
     def process_plain_text(self, lines):
         """Process plain text."""
-        return _process_plain_text(lines, self.config_options)
+        return _process_plain_text(lines, self.text_options)
 
     def process_png(self, image_data):
-        """Process a PNG: just save the received b64encoded data to a temp file."""
-        _, fname = tempfile.mkstemp(suffix='.png')
-        with open(fname, 'wb') as fh:
-            fh.write(base64.b64decode(image_data))
-        return fname
+        """Process a PNG: store the received b64encoded data, optimized if configured.
+
+        If not optimized, the image is decoded in chunks straight into the stored file.
+        """
+        dpi = self.config_options.get("image-dpi")
+        jpeg_quality = self.config_options.get("image-jpeg-quality")
+        width = _target_width(self.cell_options.get("output-image-size"), dpi)
+        if not width and not jpeg_quality:
+            path = self.image_store.store_base64(image_data, '.png')
+            self.images.append(path)
+            return str(path)
+
+        import base64
+
+        raw_png = base64.b64decode(image_data)
+        optimized = _optimize_png(raw_png, width, jpeg_quality)
+        if optimized is None:
+            path = self.image_store.store(raw_png, '.png')
+        else:
+            path = self.image_store.store_file(optimized)
+        self.images.append(path)
+        return str(path)
+
+    def process_pdf(self, image_data):
+        """Process a PDF: store the received b64encoded data, to be included as is."""
+        path = self.image_store.store_base64(image_data, '.pdf')
+        self.images.append(path)
+        return str(path)
+
+    def process_jpeg(self, image_data):
+        """Process a JPEG: store the received b64encoded data, to be included as is."""
+        path = self.image_store.store_base64(image_data, '.jpg')
+        self.images.append(path)
+        return str(path)
 
     def process_svg(self, image_data):
-        """Process a SVG: save the data, transform to PDF, and then use that."""
-        _, svg_fname = tempfile.mkstemp(suffix='.svg')
-        _, pdf_fname = tempfile.mkstemp(suffix='.pdf')
-        raw_svg = ''.join(image_data).encode('utf8')
-        with open(svg_fname, 'wb') as fh:
-            fh.write(raw_svg)
-
-        cmd = [
-            'inkscape',
-            '--export-text-to-path',
-            '--export-type=pdf',
-            f'--export-filename={pdf_fname}',
-            svg_fname,
-        ]
-        subprocess.run(cmd)
-
-        return pdf_fname
+        """Process a SVG: transform to PDF (or reuse a previous conversion), and then use that."""
+        converter_name = self.config_options.get("svg-converter")
+        pdf_path = _convert_svg(''.join(image_data).encode('utf8'), converter_name)
+        if not pdf_path.exists():
+            raise ValueError("The SVG image could not be converted to PDF (check {}).".format(
+                _svg_converter(converter_name).name))
+        path = self.image_store.store_file(pdf_path)
+        self.images.append(path)
+        return str(path)
 
     def include_graphics(self, fname):
         """Wrap a filename in an includegraphics structure."""
@@ -206,11 +1494,14 @@ class ItemProcessor:
         return [item]
 
     # mimetype and list of functions to apply; order is important here as we want to
-    # prioritize getting some mimetypes over others when multiple are present
+    # prioritize getting some mimetypes over others when multiple are present (by default,
+    # a PDF is preferred to a SVG as it doesn't need to be converted)
     PROCESSORS = [
         ('text/latex',),
+        ('application/pdf', process_pdf, include_graphics, listwrap),
         ('image/svg+xml', process_svg, include_graphics, listwrap),
         ('image/png', process_png, include_graphics, listwrap),
+        ('image/jpeg', process_jpeg, include_graphics, listwrap),
         ('text/plain', process_plain_text),
     ]
 
@@ -220,19 +1511,57 @@ class Notebook:
 
     _configs_validator = {
         "output-text-limit": _validator_positive_int,
+        "svg-workers": _validator_positive_int,
+        "output-max-lines": _validator_positive_int,
+        "output-max-bytes": _validator_positive_int,
+        "image-dpi": _validator_positive_int,
+        "image-jpeg-quality": _validator_jpeg_quality,
+        "highlighter": _validator_highlighter,
+        "mimetype-priority": _validator_mimetypes,
+        "svg-converter": _validator_svg_converter,
+        "render-workers": _validator_positive_int,
     }
 
     def __init__(self, notebook_path, config_options):
         self.config_options = self._validate_config(config_options)
         self.cell_options = {}
-        nb_data = json.loads(notebook_path.read_text())
+        self.image_store = ImageStore(
+            pathlib.Path(self.config_options.get("image-dir") or DEFAULT_IMAGE_DIR))
+        self._notebook_path = notebook_path
+        self.render_cache = RenderCache(DiskCache(_cache_dir()))
+        self.used_images = set()  # by the rendered cells
+        self._prepared = {}  # the cells to render already looked up in the cache
+
+        if notebook_path.stat().st_size >= PARSED_CACHE_MIN_SIZE:
+            # big notebook: use the index, outputs will be loaded only for the used cells
+            lang, self._cells = _load_notebook_index(notebook_path)
+        else:
+            nb_data = json.loads(notebook_path.read_text())
+            lang = nb_data['metadata']['language_info']['name']
+
+            # get all cells excluding markdown ones
+            self._cells = [x for x in nb_data['cells'] if x['cell_type'] != 'markdown']
 
         # get the languaje, to highlight
-        lang = nb_data['metadata']['language_info']['name']
         self._highlight_delimiters = HIGHLIGHTERS.get(lang, HIGHLIGHTERS[None])
+        self._pygments_highlight = None  # the language and Pygments version, if used
+        if self.config_options.get("highlighter") == "pygments" and lang:
+            pygments_version = _pygments_version()
+            if pygments_version is not None:
+                self._pygments_highlight = (lang, pygments_version)
+
+    def __getstate__(self):
+        """Return the state to pickle (e.g. to send to render workers), without what's prepared.
 
-        # get all cells excluding markdown ones
-        self._cells = [x for x in nb_data['cells'] if x['cell_type'] != 'markdown']
+        Only what's needed to render the cells is sent: for big notebooks it's their index,
+        so each worker loads just the outputs of the cells it renders.
+        """
+        return dict(self.__dict__, _prepared={})
+
+    @property
+    def highlights_with_pygments(self):
+        """Tell if the code is highlighted with Pygments (so its style must be defined)."""
+        return self._pygments_highlight is not None
 
     def _validate_config(self, config):
         """Validate received configuration."""
@@ -244,7 +1573,7 @@ class Notebook:
         return config
 
     def _proc_src(self, content):
-        """Process the source of a cell."""
+        """Process the source of a cell, return its lines."""
         source = content['source']
         result = []
 
@@ -253,67 +1582,276 @@ class Notebook:
             source = [source]  # Convert single string to a list
 
         if content['cell_type'] == 'code':
-            begin, end = self._highlight_delimiters
-            result.extend(begin)
-            result.extend(line.rstrip() for line in source)
-            result.extend(end)
+            highlighted = None
+            if self._pygments_highlight is not None:
+                code = "\n".join(line.rstrip() for line in source)
+                highlighted = _highlight_source(code, self._pygments_highlight[0])
+            if highlighted is None:
+                begin, end = self._highlight_delimiters
+                result.extend(begin)
+                result.extend(line.rstrip() for line in source)
+                result.extend(end)
+            else:
+                result.extend(highlighted)
         else:
             raise ValueError(
                 "Cell type not supported when processing source: {!r}".format(
                     content['cell_type']))
 
-        return '\n'.join(result)
+        return result
 
-    def _proc_out(self, content):
-        """Process the output of a cell."""
+    def _proc_out(self, content, processor=None):
+        """Process the output of a cell, return its lines (None if there are no outputs)."""
         outputs = content.get('outputs')
         if not outputs:
             return
 
         result = []
-        processor = ItemProcessor(self.cell_options, self.config_options)
+        if processor is None:
+            processor = ItemProcessor(self.cell_options, self.config_options, self.image_store)
         for item in outputs:
             output_type = item['output_type']
             if output_type in ('execute_result', 'display_data'):
                 more_content = processor.get_item_data(item)
             elif output_type == 'stream':
-                more_content = processor.process_plain_text(item["text"])
+                with TIMER.phase("stream"):
+                    more_content = processor.process_plain_text(item["text"])
             elif output_type == 'error':
-                raw_traceback = item['traceback']
-                tback_lines = []
-                for raw_line in raw_traceback:
-                    internal_lines = raw_line.split('\n')
-                    for line in internal_lines:
-                        line = re.sub(r"\x1b\[\d.*?m", "", line)  # sanitize
-                        if set(line) == {'-'}:
-                            # ignore separator, as our graphical box already has one
-                            continue
-                        tback_lines.append(line)
-                more_content = processor.process_plain_text(tback_lines)
+                with TIMER.phase("error"):
+                    raw_traceback = item['traceback']
+                    tback_lines = []
+                    for raw_line in raw_traceback:
+                        internal_lines = TRACEBACK_ESCAPE_RE.sub("", raw_line).split('\n')
+                        for line in internal_lines:
+                            if set(line) == {'-'}:
+                                # ignore separator, as our graphical box already has one
+                                continue
+                            tback_lines.append(line)
+                    more_content = processor.process_plain_text(tback_lines)
             else:
                 raise ValueError("Output type not supported in item {!r}".format(item))
             result.extend(more_content)
 
-        return '\n'.join(result)
+        return result
+
+    def convert_svgs(self, cells):
+        """Convert all SVG images to be shown in the selected cells, concurrently.
+
+        Only the cells not already rendered are considered (and not the ones of which only
+        the input is shown). What is found here is kept for when each cell is rendered (the
+        cached rendering, or the cell with its outputs if they were parsed to find images),
+        so nothing is looked up or parsed twice.
+
+        The images are distributed in batches among the workers, each batch converted by a
+        single inkscape process. The results are left in the conversions cache, so later
+        processing of each cell (in order) just reuses them.
+        """
+        self._prepared = {}
+        images = set()
+        for cell in cells:
+            # any problem with the cell or its outputs is skipped here, it will be properly
+            # reported when processing the cell
+            outputs = cell.partial != "i"
+            try:
+                content, raw_outputs = self._unrendered_cell(cell.index, outputs)
+                key = self._render_key(content, raw_outputs)
+            except Exception:
+                continue
+            cached = self.render_cache.get(key)
+            if cached is not None:
+                self._prepared[cell.index, outputs] = (key, cached, None)
+                continue
+            if raw_outputs is not None:
+                if SVG_MIMETYPE not in raw_outputs:
+                    # no need to parse the outputs now (nor keep them), they have no SVGs
+                    self._prepared[cell.index, outputs] = (key, None, None)
+                    continue
+                try:
+                    content = dict(content, outputs=json.loads(raw_outputs))
+                except Exception:
+                    continue
+            self._prepared[cell.index, outputs] = (key, None, content)
+
+            for item in content.get('outputs') or []:
+                try:
+                    if item['output_type'] not in ('execute_result', 'display_data'):
+                        continue
+                    mimetype, _ = ItemProcessor.select_mimetype(
+                        item['data'], self.config_options.get("mimetype-priority"))
+                    if mimetype == 'image/svg+xml':
+                        images.add(''.join(item['data'][mimetype]).encode('utf8'))
+                except Exception:
+                    continue
+        if not images:
+            return
+
+        from concurrent.futures import ThreadPoolExecutor
+
+        def _convert(batch):
+            try:
+                _convert_svgs_batch(batch, self.config_options.get("svg-converter"))
+            except Exception:
+                pass  # will be properly reported when processing the cell
+
+        workers = self.config_options.get("svg-workers") or os.cpu_count() or 1
+        images = sorted(images)
+        batches = [images[idx::workers] for idx in range(min(workers, len(images)))]
+        with ThreadPoolExecutor(max_workers=len(batches)) as executor:
+            list(executor.map(_convert, batches))
+
+    def render_ahead(self, cells, workers=None):
+        """Generate the selected cells, rendering ahead in other processes the ones not cached.
+
+        With several workers, the cells that need to be rendered (the ones not found in the
+        cache by `convert_svgs`) are sent to a pool of processes, at most a few per worker
+        ahead of the cell being generated; each cell is generated when its rendering is
+        ready, always in order. If the rendering fails in the worker the cell is left to be
+        rendered again here, so the problem is reported as usual.
+        """
+        to_render = []
+        for cell in cells:
+            prepared = self._prepared.get((cell.index, cell.partial != "i"))
+            if prepared is not None and prepared[1] is None:
+                to_render.append(cell)
+        if not workers or workers == 1 or len(to_render) < 2:
+            yield from cells
+            return
+
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        to_render = deque(to_render)
+        futures = {}
+        with ProcessPoolExecutor(
+                max_workers=min(workers, len(to_render)),
+                initializer=_init_render_worker, initargs=(self,)) as executor:
+            for cell in cells:
+                while to_render and len(futures) < workers * RENDER_AHEAD_PER_WORKER:
+                    ahead = to_render.popleft()
+                    try:
+                        futures[ahead.index] = executor.submit(
+                            _render_in_worker, ahead.index, ahead.partial != "i")
+                    except Exception:
+                        to_render.clear()  # the pool is broken, the rest are rendered here
+
+                future = futures.pop(cell.index, None)
+                if future is not None:
+                    try:
+                        rendered = future.result()
+                    except Exception:
+                        pass  # rendered again when requested, to report the problem
+                    else:
+                        prepared_key = (cell.index, cell.partial != "i")
+                        key, _, _ = self._prepared[prepared_key]
+                        self._prepared[prepared_key] = (key, rendered, None)
+                yield cell
+
+    def _read_raw_outputs(self, content):
+        """Return the raw outputs from the notebook for a cell from the index (else None)."""
+        if content.get('_outputs_span') is None:
+            return
+
+        outputs_start, outputs_end = content['_outputs_span']
+        with self._notebook_path.open('rb') as fh:
+            fh.seek(outputs_start)
+            return fh.read(outputs_end - outputs_start)
+
+    def _get_cell(self, cell_idx):
+        """Return a cell, loading its outputs from the notebook if came from the index."""
+        content = self._cells[cell_idx - 1]
+        raw_outputs = self._read_raw_outputs(content)
+        if raw_outputs is None:
+            return content
+        return dict(content, outputs=json.loads(raw_outputs))
+
+    def _unrendered_cell(self, cell_idx, outputs=True):
+        """Return a cell to render and its raw outputs (if it came from the index, else None).
+
+        If the outputs are not needed they are left out, also from the key.
+        """
+        content = self._cells[cell_idx - 1]
+        if outputs:
+            raw_outputs = self._read_raw_outputs(content)
+        else:
+            content = {
+                key: value for key, value in content.items()
+                if key not in ('outputs', '_outputs_span')}
+            raw_outputs = None
+        return content, raw_outputs
+
+    def _render_key(self, content, raw_outputs):
+        """Build the key for a cell rendering, from everything that affects it.
+
+        The position of the outputs in the notebook (for cells from the index) is left out,
+        as it changes when any previous cell is edited; the outputs themselves are included.
+        """
+        cell = {key: value for key, value in content.items() if key != '_outputs_span'}
+        return self.render_cache.cache.build_key(
+            _code_version(),
+            json.dumps(cell, sort_keys=True),
+            raw_outputs or b'',
+            json.dumps(self._highlight_delimiters),
+            json.dumps(self._pygments_highlight),
+            json.dumps({
+                key: value for key, value in self.config_options.items()
+                if key not in RENDER_NEUTRAL_OPTIONS}, sort_keys=True),
+            json.dumps(self.cell_options, sort_keys=True),
+            str(self.image_store.base_dir),
+        )
 
     def get(self, cell_idx):
         """Return the content from a specific cell in the notebook.
 
         The content is already splitted in source and output, and converted to latex.
         """
-        content = self._cells[cell_idx - 1]
-        source = self._proc_src(content)
-        output = self._proc_out(content)
+        source, output = self.get_lines(cell_idx)
+        return '\n'.join(source), None if output is None else '\n'.join(output)
+
+    def get_lines(self, cell_idx, outputs=True):
+        """Return the lines of the source and output from a specific cell in the notebook.
+
+        If the outputs are not needed, they are not rendered (and the output is None). The
+        images used by the cell are recorded in `used_images`.
+        """
+        source, output, images = self._render_cell(cell_idx, outputs)
+        self.used_images.update(images)
         return source, output
 
+    def _render_cell(self, cell_idx, outputs=True):
+        """Render a cell, returning the lines of its source and output, and the images used.
+
+        It's reused from a previous rendering if nothing changed in the cell and its options.
+        """
+        prepared = self._prepared.pop((cell_idx, outputs), None)
+        if prepared is None:
+            content, raw_outputs = self._unrendered_cell(cell_idx, outputs)
+            key = self._render_key(content, raw_outputs)
+            cached = self.render_cache.get(key)
+        else:
+            key, cached, content = prepared
+            raw_outputs = None
+            if cached is None and content is None:
+                content, raw_outputs = self._unrendered_cell(cell_idx, outputs)
+        if cached is not None:
+            return cached
+
+        if raw_outputs is not None:
+            content = dict(content, outputs=json.loads(raw_outputs))
+        processor = ItemProcessor(self.cell_options, self.config_options, self.image_store)
+        source = self._proc_src(content)
+        output = self._proc_out(content, processor)
+        images = [str(x) for x in processor.images]
+        self.render_cache.put(key, source, output, images)
+        return source, output, images
+
     def parse_cells(self, spec):
-        """Convert the cells spec to a range of ints."""
+        """Convert the cells spec to the selected cells (a `CellSelections`)."""
         if not spec:
             raise ValueError("Empty cells spec not allowed")
 
         maxlen = len(self._cells)
 
-        cells = set()
+        intervals = []
         options = {}
         groups = [x.strip() for x in spec.split(',')]
         valid_chars = set('0123456789-,')
@@ -341,70 +1879,623 @@ class Notebook:
                 if cfrom >= cto:
                     raise ValueError(
                         "Range 'from' need to be smaller than 'to' (got {!r})".format(group))
-                cells.update(CellSelection(x, partial=partial) for x in range(cfrom, cto + 1))
+                intervals.append((cfrom, cto, partial))
             else:
-                cells.add(CellSelection(int(group), partial=partial))
-        cells = sorted(cells)
+                index = int(group)
+                intervals.append((index, index, partial))
+        intervals.sort()
 
-        if any(x.index < 1 for x in cells):
+        if intervals[0][0] < 1:
             raise ValueError("Cells need to be >=1")
-        if len(cells) != len(set(cell.index for cell in cells)):
-            raise ValueError("Mixed different parts indication for the same cell.")
-        if maxlen < cells[-1].index:
+
+        # merge the overlapping or contiguous intervals of the same part; as they are sorted,
+        # any overlap can only be with the last merged one
+        merged = []
+        for first, last, partial in intervals:
+            if merged:
+                merged_first, merged_last, merged_partial = merged[-1]
+                if partial == merged_partial and first <= merged_last + 1:
+                    merged[-1] = (merged_first, max(last, merged_last), partial)
+                    continue
+                if first <= merged_last:
+                    raise ValueError("Mixed different parts indication for the same cell.")
+            merged.append((first, last, partial))
+
+        if maxlen < merged[-1][1]:
             raise ValueError(f"Notebook loaded of len {maxlen}, smaller than requested cells")
 
         self.cell_options = options
-        return cells
+        return CellSelections(merged)
 
 
-def main(notebook_path, cells_spec, config_options):
-    """Main entry point."""
-    nb = Notebook(notebook_path, config_options)
-    cells = nb.parse_cells(cells_spec)
+def render_chunks(nb, notebook_path, cells_spec, config_options):
+    """Generate the LaTeX for the specified cells of an already loaded notebook, in chunks.
+
+    Each cell is fully rendered before yielding anything of it, as if it fails an error box
+    is produced instead.
+    """
+    with TIMER.phase("parse_cells"):
+        cells = nb.parse_cells(cells_spec)
+    with TIMER.phase("convert_svgs"):
+        nb.convert_svgs(cells)
+    nb.used_images.clear()
+    if nb.highlights_with_pygments:
+        yield from _as_chunks(_pygments_style_defs())
 
     # get templates from config
     cells_id_template = config_options.get("cells-id-template", "Cell {number:02d}")
     first_cell_id_template = config_options.get("first-cell-id-template", cells_id_template)
 
     escaped_path_name = latex_escape(notebook_path.name)
-    tcolorbox_begin_template = r"\begin{{tcolorbox}}[{}, breakable, title={}]"
-    for cell in cells:
+    tcolorbox_begin_template = "\\begin{{tcolorbox}}[{}, breakable, title={}]\n"
+    for cell in nb.render_ahead(cells, nb.config_options.get("render-workers")):
         try:
-            src, out = nb.get(cell.index)
+            with TIMER.phase(f"cell {cell.index}"):
+                src, out = nb.get_lines(cell.index, outputs=cell.partial != "i")
         except Exception as exc:
             title = "ERROR when parsing cell {}".format(cell.index)
-            print(tcolorbox_begin_template.format(FORMAT_ERROR, title))
-            print(exc)
-            _parts = _process_plain_text(REPORT_MSG.split('\n'))
-            print('\n'.join(_parts))
-            print(r"\end{tcolorbox}")
+            yield tcolorbox_begin_template.format(FORMAT_ERROR, title)
+            yield f"{exc}\n"
+            yield from _as_chunks(_process_plain_text(REPORT_MSG.split('\n')))
+            yield "\\end{tcolorbox}\n"
 
             # send title and traceback to stderr, which will appear in compilation log
+            import traceback
+
             tb = traceback.format_exc()
             print(tb, file=sys.stderr)
             continue
 
         template = first_cell_id_template if cell.index == 1 else cells_id_template
         title = template.format(number=cell.index, filename=escaped_path_name)
-        print(tcolorbox_begin_template.format(FORMAT_OK, title))
+        yield tcolorbox_begin_template.format(FORMAT_OK, title)
 
+        has_output = bool(out) and out != [""]  # same as the joined lines not being empty
         if cell.partial == "i":
-            print(src)
-        elif cell.partial == "o" and out:
-            print(out)
+            yield from _as_chunks(src)
+        elif cell.partial == "o" and has_output:
+            yield from _as_chunks(out)
         else:
             # more usual case, both input and outputs (separated by a line)
-            print(src)
-            if out:
-                print(r"\tcblower")
-                print(out)
+            yield from _as_chunks(src)
+            if has_output:
+                yield "\\tcblower\n"
+                yield from _as_chunks(out)
 
-        print(r"\end{tcolorbox}")
-        print()  # extra new line so boxes are separated in the LaTeX PoV
+        yield "\\end{tcolorbox}\n"
+        yield "\n"  # extra new line so boxes are separated in the LaTeX PoV
 
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser()
+# the notebook loaded in each render worker process
+_worker_notebook = None
+
+
+def _init_render_worker(nb):
+    """Initialize a render worker process with the notebook to render."""
+    global _worker_notebook
+    _worker_notebook = nb
+
+
+def _render_in_worker(cell_idx, outputs):
+    """Render a cell in a worker process (it's also left in the rendered cells cache)."""
+    return _worker_notebook._render_cell(cell_idx, outputs)
+
+
+def _as_chunks(lines):
+    """Generate the lines to be written, a chunk each (with its newline)."""
+    for line in lines:
+        yield line + "\n"
+
+
+def render(nb, notebook_path, cells_spec, config_options, file=None):
+    """Write the LaTeX for the specified cells of an already loaded notebook.
+
+    All the chunks are written through the (buffered) file, not separately.
+    """
+    if file is None:
+        file = sys.stdout
+    file.writelines(render_chunks(nb, notebook_path, cells_spec, config_options))
+
+
+def _cache_info(nb):
+    """Return the information about the rendered cells cache to include in the timing report."""
+    cache = nb.render_cache
+    return {"rendered cells cache": f"{cache.hits} hits, {cache.misses} misses"}
+
+
+def _make_escape(path):
+    """Escape a path to be used in a Make rule."""
+    return str(path).replace("$", "$$").replace("#", r"\#").replace(" ", r"\ ")
+
+
+def update_dependency_file(depfile, target, calls):
+    r"""Update the dependency file (in Make format) with the files used by the indicated calls.
+
+    The calls are a dict of each \jupynotex call (the notebook and cells spec) to the files
+    it used. The rules of other calls already in the file are kept. Also an empty rule is
+    added for each file, so Make doesn't fail if it is removed (as 'gcc -MP' does).
+    """
+    rules = {}
+    try:
+        content = depfile.read_text(encoding="utf8")
+    except FileNotFoundError:
+        content = ""
+    for line in content.splitlines():
+        match = DEPENDENCY_RULE_RE.match(line)
+        if match:
+            rule_target, prerequisites, call = match.groups()
+            rules[rule_target, call] = prerequisites
+    for call, paths in calls.items():
+        rules[_make_escape(target), call] = " ".join(_make_escape(path) for path in paths)
+
+    lines = ["# the notebooks and images used by jupynotex, updated on each run"]
+    all_prerequisites = {}
+    for (rule_target, call), prerequisites in rules.items():
+        lines.append(f"{rule_target}: {prerequisites}  # jupynotex call: {call}")
+        all_prerequisites.update(dict.fromkeys(MAKE_WORD_RE.findall(prerequisites)))
+    lines.append("")
+    lines.extend(f"{prerequisite}:" for prerequisite in all_prerequisites)
+
+    # written atomically, as other processes may be reading it
+    temp_path = _temp_path(depfile)
+    temp_path.write_text("\n".join(lines) + "\n", encoding="utf8")
+    os.replace(temp_path, depfile)
+
+
+def _dependencies(nb, notebook_path):
+    """Return the files used in the last rendering of the notebook."""
+    return [notebook_path, *sorted(nb.used_images)]
+
+
+def _write_dependencies(nb, notebook_path, cells_spec, config_options):
+    """Record the files used in the rendering, if configured."""
+    depfile = config_options.get("dependency-file")
+    if depfile:
+        depfile = pathlib.Path(depfile)
+        call = f"{notebook_path} [{cells_spec}]"
+        update_dependency_file(
+            depfile, depfile.with_suffix(".pdf"), {call: _dependencies(nb, notebook_path)})
+
+
+def _maintain_cache(cache, hits, misses):
+    """Record the use of the rendered cells cache, and prune it if it may be too big.
+
+    The whole cache is scanned only if what was added makes it exceed the max size (or its
+    size is not known, or it was not scanned for a while).
+    """
+    added_size = cache.added_size()
+    if not (hits or misses or added_size):
+        return
+    stats = cache.record_stats(hits, misses, added_size)
+    if not (misses or added_size):
+        return
+    max_size = _cache_max_size()
+    size = stats.get("size")
+    if (size is None or size > max_size
+            or time.time() - stats.get("scanned", 0) > CACHE_RESCAN_INTERVAL):
+        cache.prune(max_size, int(max_size * CACHE_PRUNE_RATIO))
+
+
+def main(notebook_path, cells_spec, config_options):
+    """Main entry point."""
+    TIMER.start(config_options.get("timing") or os.environ.get("JUPYNOTEX_TIMING"))
+    tini = time.perf_counter()
+    with TIMER.phase("load"):
+        nb = Notebook(notebook_path, config_options)
+    render(nb, notebook_path, cells_spec, config_options)
+    _write_dependencies(nb, notebook_path, cells_spec, config_options)
+    _maintain_cache(nb.render_cache.cache, nb.render_cache.hits, nb.render_cache.misses)
+
+    TIMER.report(notebook_path, time.perf_counter() - tini, _cache_info(nb))
+
+
+def find_jupynotex_calls(tex_text):
+    r"""Find all the \jupynotex calls in a LaTeX source, return (notebook, cells spec) pairs.
+
+    Both values are returned with their whitespace normalized, the same way TeX reads them.
+    """
+    tex_text = re.sub(r"(?<!\\)%.*", "", tex_text)  # remove comments
+    calls = []
+    for cells_spec, notebook in JUPYNOTEX_CALL_RE.findall(tex_text):
+        cells_spec = re.sub(r"\s+", " ", cells_spec) if cells_spec else "-"
+        calls.append((re.sub(r"\s+", " ", notebook), cells_spec))
+    return calls
+
+
+def fragment_name(notebook, cells_spec):
+    """Return the name (no extension) of the precompiled fragment for a call.
+
+    It's the same MD5 that the .sty calculates for the call, to find the fragment.
+    """
+    return hashlib.md5(f"{notebook}|{cells_spec}".encode("utf8")).hexdigest().upper()
+
+
+def fragment_stamp(notebook_path, config_options):
+    """Build the stamp that tells if a fragment is still up to date.
+
+    It's composed by the MD5 of the notebook's content and the MD5 of the global options
+    (in the same order as in the command line); the .sty calculates the same to compare.
+    """
+    file_md5 = _file_hash(notebook_path, hashlib.md5).upper()
+    options = "|".join(config_options.get(option, "") for option in CMDLINE_OPTION_NAMES)
+    options_md5 = hashlib.md5(options.encode("utf8")).hexdigest().upper()
+    return f"{file_md5}/{options_md5}"
+
+
+def _precompile_notebook(notebook, cells_specs, config_options):
+    """Render all the calls for a notebook into fragment files.
+
+    Return the list of problems found (if any), and the files used by each rendered call.
+    """
+    problems = []
+    dependencies = {}
+    notebook_path = pathlib.Path(notebook)
+    try:
+        stamp = fragment_stamp(notebook_path, config_options)
+        nb = Notebook(notebook_path, dict(config_options))
+    except Exception as exc:
+        return [f"{notebook}: {exc!r}"], dependencies
+
+    FRAGMENTS_DIR.mkdir(parents=True, exist_ok=True)
+    for cells_spec in cells_specs:
+        basepath = FRAGMENTS_DIR / fragment_name(notebook, cells_spec)
+        tex_path = basepath.with_suffix(".tex")
+        temp_path = basepath.with_suffix(".tex.tmp")
+        try:
+            with temp_path.open("wt", encoding="utf8") as fh:
+                render(nb, notebook_path, cells_spec, dict(nb.config_options), file=fh)
+        except Exception as exc:
+            temp_path.unlink(missing_ok=True)
+            problems.append(f"{notebook} [{cells_spec}]: {exc!r}")
+            continue
+        temp_path.replace(tex_path)
+        dependencies[cells_spec] = _dependencies(nb, notebook_path)
+
+        # the stamp is written last, so a fragment is never used if not complete
+        stamp_line = r"\expandafter\def\csname jupynotex@stamp\endcsname{" + stamp + "}\n"
+        basepath.with_suffix(".stamp").write_text(stamp_line, encoding="utf8")
+
+    _maintain_cache(nb.render_cache.cache, nb.render_cache.hits, nb.render_cache.misses)
+    return problems, dependencies
+
+
+def precompile(tex_paths, config_options, workers=None):
+    r"""Render all the \jupynotex calls found in the LaTeX sources.
+
+    The notebooks are processed in parallel, each one loaded only once for all its calls.
+    If configured, the files used are recorded in the dependency file, for the PDF named
+    after each LaTeX source. Return the list of problems found (if any).
+    """
+    calls_per_notebook = {}
+    calls_per_source = {}
+    for tex_path in tex_paths:
+        calls = find_jupynotex_calls(tex_path.read_text(encoding="utf8"))
+        calls_per_source[tex_path] = calls
+        for notebook, cells_spec in calls:
+            specs = calls_per_notebook.setdefault(notebook, [])
+            if cells_spec not in specs:
+                specs.append(cells_spec)
+    if not calls_per_notebook:
+        return []
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    problems = []
+    dependencies = {}
+    workers = min(workers or os.cpu_count() or 1, len(calls_per_notebook))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            notebook: executor.submit(_precompile_notebook, notebook, specs, config_options)
+            for notebook, specs in calls_per_notebook.items()}
+        for notebook, future in futures.items():
+            notebook_problems, notebook_dependencies = future.result()
+            problems.extend(notebook_problems)
+            for cells_spec, paths in notebook_dependencies.items():
+                dependencies[notebook, cells_spec] = paths
+
+    depfile = config_options.get("dependency-file")
+    if depfile:
+        for tex_path, calls in calls_per_source.items():
+            used = {
+                f"{pathlib.Path(notebook)} [{cells_spec}]": dependencies[notebook, cells_spec]
+                for notebook, cells_spec in calls if (notebook, cells_spec) in dependencies}
+            update_dependency_file(pathlib.Path(depfile), tex_path.with_suffix(".pdf"), used)
+    return problems
+
+
+def _socket_path():
+    """Return the path of the socket where the render daemon listens.
+
+    It can be forced with the JUPYNOTEX_SOCKET environment variable, otherwise it's in the
+    cache directory.
+    """
+    forced_path = os.environ.get("JUPYNOTEX_SOCKET")
+    if forced_path:
+        return pathlib.Path(forced_path)
+    return _cache_dir() / "daemon.sock"
+
+
+class _CachingNotebook(Notebook):
+    """A notebook that keeps in memory the already rendered cells."""
+
+    def __init__(self, notebook_path, config_options):
+        from collections import OrderedDict
+
+        super().__init__(notebook_path, config_options)
+        self._rendered = OrderedDict()
+
+    def __getstate__(self):
+        """Return the state to pickle, without the rendered cells kept in memory."""
+        from collections import OrderedDict
+
+        return dict(super().__getstate__(), _rendered=OrderedDict())
+
+    def _memory_key(self, cell_idx, outputs):
+        """Return the key of a rendered cell in memory.
+
+        The images directory is part of the key, as it may be relative to the directory
+        where each request is processed.
+        """
+        return (
+            cell_idx, outputs, tuple(sorted(self.cell_options.items())),
+            str(self.image_store.base_dir.resolve()))
+
+    def _remembered(self, key):
+        """Return the rendered cell from memory, if there and the images it uses still are."""
+        rendered = self._rendered.get(key)
+        if rendered is not None and all(os.path.exists(image) for image in rendered[2]):
+            return rendered
+
+    def convert_svgs(self, cells):
+        """Convert the SVG images of the selected cells, if not already rendered in memory."""
+        super().convert_svgs([
+            cell for cell in cells
+            if self._remembered(self._memory_key(cell.index, cell.partial != "i")) is None])
+
+    def _render_cell(self, cell_idx, outputs=True):
+        """Render a cell, only the first time (while the images it uses are there)."""
+        key = self._memory_key(cell_idx, outputs)
+        rendered = self._remembered(key)
+        if rendered is not None:
+            self._rendered.move_to_end(key)
+            return rendered
+
+        rendered = self._rendered[key] = super()._render_cell(cell_idx, outputs)
+        self._rendered.move_to_end(key)
+        if len(self._rendered) > DAEMON_MAX_RENDERED_CELLS:
+            self._rendered.popitem(last=False)
+        return rendered
+
+
+class RenderServer:
+    """A long running server that keeps the loaded notebooks (and rendered cells) in memory.
+
+    It listens on a Unix socket (not available in all systems, e.g. old Windows ones).
+    Requests are served one at a time, as each one is processed in the client's directory.
+    """
+
+    def __init__(self, socket_path):
+        import socketserver
+        from collections import OrderedDict
+
+        self.notebooks = OrderedDict()
+        render_server = self
+
+        class _RenderRequestHandler(socketserver.StreamRequestHandler):
+            """Handle a render request: one JSON line in, one JSON document out."""
+
+            def handle(self):
+                raw_request = self.rfile.readline()
+                if not raw_request:
+                    return  # the client was just checking if the daemon is alive
+                request = json.loads(raw_request)
+                response = render_server.render_request(request)
+                self.wfile.write(json.dumps(response).encode("utf8"))
+
+        self._server = socketserver.UnixStreamServer(str(socket_path), _RenderRequestHandler)
+
+    def serve_forever(self, poll_interval=0.5):
+        """Serve requests until shutdown."""
+        self._server.serve_forever(poll_interval=poll_interval)
+
+    def shutdown(self):
+        """Stop serving (from other thread)."""
+        self._server.shutdown()
+
+    def server_close(self):
+        """Release the socket."""
+        self._server.server_close()
+
+    def _get_notebook(self, notebook_path, config_options):
+        """Return the notebook from memory, loading it if new or changed on disk."""
+        notebook_path = notebook_path.resolve()
+        stat = notebook_path.stat()
+        fingerprint = (stat.st_size, stat.st_mtime_ns)
+        key = (notebook_path, json.dumps(config_options, sort_keys=True))
+        if key in self.notebooks:
+            stored_fingerprint, nb = self.notebooks[key]
+            if stored_fingerprint == fingerprint:
+                self.notebooks.move_to_end(key)
+                return nb
+        nb = _CachingNotebook(notebook_path, dict(config_options))
+        self.notebooks[key] = (fingerprint, nb)
+        self.notebooks.move_to_end(key)
+        if len(self.notebooks) > DAEMON_MAX_NOTEBOOKS:
+            self.notebooks.popitem(last=False)
+        return nb
+
+    def render_request(self, request):
+        """Render what was requested, return the output and errors (what goes to stderr)."""
+        import contextlib
+        import io
+        import traceback
+
+        output = io.StringIO()
+        errors = io.StringIO()
+        previous_cwd = os.getcwd()
+        try:
+            os.chdir(request["cwd"])
+            notebook_path = pathlib.Path(request["notebook_path"])
+            config_options = request["config_options"]
+            with contextlib.redirect_stderr(errors):
+                TIMER.start(config_options.get("timing") or os.environ.get("JUPYNOTEX_TIMING"))
+                tini = time.perf_counter()
+                with TIMER.phase("load"):
+                    nb = self._get_notebook(notebook_path, config_options)
+                render_cache = nb.render_cache
+                previous_hits, previous_misses = render_cache.hits, render_cache.misses
+                render(
+                    nb, notebook_path, request["cells_spec"], dict(nb.config_options),
+                    file=output)
+                _write_dependencies(nb, notebook_path, request["cells_spec"], config_options)
+                _maintain_cache(
+                    render_cache.cache, render_cache.hits - previous_hits,
+                    render_cache.misses - previous_misses)
+                TIMER.report(notebook_path, time.perf_counter() - tini, _cache_info(nb))
+        except Exception:
+            return {"output": "", "errors": errors.getvalue() + traceback.format_exc()}
+        finally:
+            os.chdir(previous_cwd)
+        return {"output": output.getvalue(), "errors": errors.getvalue()}
+
+
+def serve(socket_path):
+    """Run the render daemon until interrupted."""
+    if socket_path.exists():
+        if request_render(socket_path, None, None, None) is not None:
+            print(f"A daemon is already running in {socket_path}", file=sys.stderr)
+            sys.exit(1)
+        socket_path.unlink()  # stale, from a daemon that didn't finish properly
+
+    socket_path.parent.mkdir(parents=True, exist_ok=True)
+    server = RenderServer(socket_path)
+    print(f"Serving in {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        socket_path.unlink()
+
+
+def request_render(socket_path, notebook_path, cells_spec, config_options):
+    """Ask the daemon to render, return its response, or None if no daemon is running.
+
+    Any problem talking with the daemon (including it not answering in time, or answering
+    garbage) is the same as not having a daemon, so the caller renders by itself.
+    """
+    if not socket_path.exists():
+        return
+    import socket
+
+    if not hasattr(socket, "AF_UNIX"):
+        return
+    request = {
+        "cwd": os.getcwd(),
+        "notebook_path": None if notebook_path is None else str(notebook_path),
+        "cells_spec": cells_spec,
+        "config_options": config_options,
+    }
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(DAEMON_TIMEOUT)
+        try:
+            sock.connect(str(socket_path))
+            if notebook_path is None:
+                return {}  # just checking if it's alive
+            sock.sendall(json.dumps(request).encode("utf8") + b"\n")
+            sock.shutdown(socket.SHUT_WR)
+            with sock.makefile("rb") as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            return
+
+
+def client_main(notebook_path, cells_spec, config_options):
+    """Render using the daemon if it's running, else fall back to do it here."""
+    response = request_render(_socket_path(), notebook_path, cells_spec, config_options)
+    if response is None:
+        main(notebook_path, cells_spec, config_options)
+        return
+
+    sys.stderr.write(response["errors"])
+    sys.stdout.write(response["output"])
+    if not response["output"] and response["errors"]:
+        sys.exit(1)
+
+
+def _config_from_args(args):
+    """Get config options from command line (ignoring '', which is the default in .sty file)."""
+    config_options = {}
+    for option in CMDLINE_OPTION_NAMES:
+        value = getattr(args, option.replace("-", "_"))
+        if value:
+            config_options[option] = value
+    return config_options
+
+
+def _precompile_cmdline(cmdline_args):
+    """Handle the 'precompile' command line."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="jupynotex.py precompile",
+        description=(
+            "Render all the \\jupynotex calls in the LaTeX sources to fragments that are "
+            "included directly; run it from the same directory where LaTeX runs."))
+    parser.add_argument("tex_paths", type=pathlib.Path, nargs="+", help="The LaTeX sources.")
+    parser.add_argument(
+        "--jobs", type=int, help="How many notebooks to process at the same time.")
+    for option, explanation in CMDLINE_OPTION_NAMES.items():
+        parser.add_argument("--" + option, type=str, default="", help=explanation)
+    args = parser.parse_args(cmdline_args)
+
+    problems = precompile(args.tex_paths, _config_from_args(args), workers=args.jobs)
+    for problem in problems:
+        print("ERROR precompiling", problem, file=sys.stderr)
+    sys.exit(1 if problems else 0)
+
+
+def _cache_cmdline(cmdline_args):
+    """Handle the 'cache' command line."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="jupynotex.py cache",
+        description=f"Manage the cache of conversions and renderings (in {_cache_dir()}).")
+    subparsers = parser.add_subparsers(dest="action", required=True)
+    subparsers.add_parser("stats", help="Show the cache size and how effective it is.")
+    prune_parser = subparsers.add_parser(
+        "prune", help="Remove the least recently used artifacts to reduce the cache size.")
+    prune_parser.add_argument(
+        "--max-size", type=_parse_size, default=None,
+        help="The size to reduce the cache to (e.g. '200M', or 0 to empty it); defaults to "
+             "the configured maximum size.")
+    args = parser.parse_args(cmdline_args)
+
+    cache = DiskCache(_cache_dir())
+    if args.action == "stats":
+        artifacts = cache.artifacts()
+        total = sum(size for _, size, _ in artifacts)
+        stats = cache.stats()
+        used = stats["hits"] + stats["misses"]
+        hit_rate = f"{stats['hits'] / used:.1%}" if used else "-"
+        print(f"Directory: {cache.base_dir}")
+        print(f"Entries: {len(artifacts)}")
+        print(f"Size: {_format_size(total)} (max {_format_size(_cache_max_size())})")
+        print(f"Rendered cells: {stats['hits']} hits, {stats['misses']} misses "
+              f"(hit rate {hit_rate})")
+    else:
+        max_size = _cache_max_size() if args.max_size is None else args.max_size
+        removed, freed = cache.prune(max_size)
+        print(f"Removed {removed} entries ({_format_size(freed)})")
+
+
+def _render_cmdline(cmdline_args, prog=None):
+    """Parse the command line used to render a notebook (as used from the .sty)."""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog=prog)
     parser.add_argument("notebook_path", type=pathlib.Path, help="The path to the notebook.")
     parser.add_argument(
         "cells_spec",
@@ -415,13 +2506,36 @@ if __name__ == "__main__":
         )
     )
     for option, explanation in CMDLINE_OPTION_NAMES.items():
-        parser.add_argument(option, type=str, help=explanation)
-    args = parser.parse_args()
+        parser.add_argument(option.replace("-", "_"), metavar=option, type=str, help=explanation)
+    args = parser.parse_args(cmdline_args)
+    return args.notebook_path, args.cells_spec, _config_from_args(args)
 
-    # get config options from command line (ignoring '', which is the default in .sty file)
-    config_options = {}
-    for option in CMDLINE_OPTION_NAMES:
-        value = getattr(args, option)
-        if value:
-            config_options[option] = value
-    main(args.notebook_path, args.cells_spec, config_options)
+
+def _serve_cmdline(cmdline_args):
+    """Handle the 'serve' command line."""
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="jupynotex.py serve",
+        description=(
+            "Run a daemon that keeps the notebooks loaded in memory, to quickly serve the "
+            "renders requested by the 'client' command (used by the .sty)."))
+    parser.add_argument(
+        "--socket", type=pathlib.Path, default=_socket_path(),
+        help="The path to the socket to listen on (defaults to %(default)s).")
+    args = parser.parse_args(cmdline_args)
+    serve(args.socket)
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "precompile":
+        _precompile_cmdline(sys.argv[2:])
+    elif command == "serve":
+        _serve_cmdline(sys.argv[2:])
+    elif command == "cache":
+        _cache_cmdline(sys.argv[2:])
+    elif command == "client":
+        client_main(*_render_cmdline(sys.argv[2:], prog="jupynotex.py client"))
+    else:
+        main(*_render_cmdline(sys.argv[1:]))
@@ -0,0 +1,29 @@
+# Copyright 2025 Facundo Batista
+# All Rights Reserved
+# Licensed under Apache 2.0
+
+import pytest
+
+import jupynotex
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(monkeypatch, tmp_path):
+    """Do not let tests use (or pollute) the real cache directory."""
+    cache_dir = tmp_path / "jupynotex-cache"
+    monkeypatch.setenv("JUPYNOTEX_CACHE_DIR", str(cache_dir))
+    return cache_dir
+
+
+@pytest.fixture(autouse=True)
+def isolated_images(monkeypatch, tmp_path):
+    """Do not let tests write images in the current directory."""
+    image_dir = tmp_path / "jupynotex-images"
+    monkeypatch.setattr(jupynotex, "DEFAULT_IMAGE_DIR", str(image_dir))
+    return image_dir
+
+
+@pytest.fixture(autouse=True)
+def no_svg_converter_detection(monkeypatch):
+    """Do not depend on the SVG converters installed in the system (inkscape is faked)."""
+    monkeypatch.setattr(jupynotex, "_detect_svg_converter", lambda: "inkscape")
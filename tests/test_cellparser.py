@@ -199,3 +199,33 @@ def test_partial_repeated_and_misordered(notebook):
         CellSelection(7, partial="o"),
     ]
     assert notebook.cell_options == {}
+
+
+def test_intervals_merged(notebook):
+    result = notebook.parse_cells('1-3, 4, 2-5, 7-8i, 9i, 10o')
+    assert result.intervals == [(1, 5, "a"), (7, 9, "i"), (10, 10, "o")]
+    assert len(result) == 9
+
+
+def test_intervals_overlapping_partials(notebook):
+    msg = "Mixed different parts indication for the same cell."
+    with pytest.raises(ValueError, match=re.escape(msg)):
+        notebook.parse_cells('1-5, 7, 4-6i')
+
+
+def test_intervals_huge_range_lazy(notebook):
+    notebook._cells = [None] * 20000
+    result = notebook.parse_cells('1-')
+    assert result.intervals == [(1, 20000, "a")]
+    assert len(result) == 20000
+    assert result[0] == CellSelection(1)
+    assert result[-1] == CellSelection(20000)
+    assert result[19998:] == [CellSelection(19999), CellSelection(20000)]
+
+
+def test_intervals_indexing(notebook):
+    result = notebook.parse_cells('2-3i, 6, 8-9o')
+    assert [result[pos] for pos in range(len(result))] == list(result)
+    assert result[2] == CellSelection(6)
+    with pytest.raises(IndexError):
+        result[5]
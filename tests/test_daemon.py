@@ -0,0 +1,192 @@
+# Copyright 2025 Facundo Batista
+# All Rights Reserved
+# Licensed under Apache 2.0
+
+import json
+import pathlib
+import shutil
+import socket
+import tempfile
+import threading
+from unittest.mock import patch
+
+import pytest
+
+import jupynotex
+from jupynotex import Notebook, RenderServer, client_main, main, request_render
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Needs Unix sockets")
+
+
+@pytest.fixture
+def notebook_path(tmp_path):
+    cells = []
+    for idx in range(1, 4):
+        cells.append({
+            'cell_type': 'code',
+            'source': [f'print({idx})'],
+            'outputs': [{'output_type': 'stream', 'text': [str(idx)]}],
+        })
+    fake_nb = {'cells': cells, 'metadata': {'language_info': {'name': None}}}
+    path = tmp_path / "test.ipynb"
+    path.write_text(json.dumps(fake_nb))
+    return path
+
+
+@pytest.fixture
+def socket_path(monkeypatch):
+    # a short path, as sockets' ones are limited in length
+    tempdir = tempfile.mkdtemp(dir="/tmp")
+    path = pathlib.Path(tempdir) / "test.sock"
+    monkeypatch.setenv("JUPYNOTEX_SOCKET", str(path))
+    yield path
+    shutil.rmtree(tempdir)
+
+
+@pytest.fixture
+def server(socket_path):
+    server = RenderServer(socket_path)
+    thread = threading.Thread(target=server.serve_forever, kwargs={"poll_interval": 0.01})
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def test_no_daemon(socket_path, notebook_path):
+    assert request_render(socket_path, notebook_path, "1", {}) is None
+
+
+def test_daemon_not_answering(socket_path, notebook_path, monkeypatch):
+    monkeypatch.setattr(jupynotex, "DAEMON_TIMEOUT", 0.1)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        listener.bind(str(socket_path))
+        listener.listen()  # connections are never accepted
+        assert request_render(socket_path, notebook_path, "1", {}) is None
+
+
+def test_daemon_failing(server, socket_path, notebook_path, capsys):
+    with patch.object(RenderServer, "render_request", side_effect=ValueError("boom")):
+        assert request_render(socket_path, notebook_path, "1", {}) is None
+
+        # so the client renders by itself
+        client_main(notebook_path, "2", {})
+    client_output = capsys.readouterr().out
+    main(notebook_path, "2", {})
+    assert client_output == capsys.readouterr().out
+
+
+def test_render_same_as_main(server, socket_path, notebook_path, capsys):
+    response = request_render(socket_path, notebook_path, "1-3", {})
+    main(notebook_path, "1-3", {})
+    assert response["output"] == capsys.readouterr().out
+    assert response["errors"] == ""
+
+
+def test_render_notebook_kept_in_memory(server, socket_path, notebook_path):
+    request_render(socket_path, notebook_path, "1", {})
+    with patch.object(Notebook, "_proc_src") as proc_mock:
+        # a cell already rendered, and the notebook not loaded again
+        response = request_render(socket_path, notebook_path, "1", {})
+    assert proc_mock.call_count == 0
+    assert "print(1)" in response["output"]
+    assert len(server.notebooks) == 1
+
+
+def test_render_workers(server, socket_path, notebook_path, capsys):
+    response = request_render(socket_path, notebook_path, "1-3", {"render-workers": "2"})
+    main(notebook_path, "1-3", {})
+    assert response["output"] == capsys.readouterr().out
+
+    # the cells rendered by the workers are kept in memory
+    with patch("concurrent.futures.ProcessPoolExecutor") as executor_mock:
+        request_render(socket_path, notebook_path, "1-3", {"render-workers": "2"})
+    assert executor_mock.call_count == 0
+
+
+def test_render_notebook_changed(server, socket_path, notebook_path):
+    request_render(socket_path, notebook_path, "1", {})
+
+    content = json.loads(notebook_path.read_text())
+    content['cells'][0]['source'] = ['print("changed")']
+    notebook_path.write_text(json.dumps(content))
+
+    response = request_render(socket_path, notebook_path, "1", {})
+    assert 'print("changed")' in response["output"]
+
+
+def _image_notebook(tmp_path):
+    """Write a notebook with an image."""
+    cell = {
+        'cell_type': 'code',
+        'source': ['show()'],
+        'outputs': [{'output_type': 'display_data', 'data': {'image/png': 'AQID'}}],
+    }
+    fake_nb = {'cells': [cell], 'metadata': {'language_info': {'name': None}}}
+    path = tmp_path / "images.ipynb"
+    path.write_text(json.dumps(fake_nb))
+    return path
+
+
+def test_render_images_removed(server, socket_path, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    notebook_path = _image_notebook(tmp_path)
+    config = {"image-dir": "images"}
+    request_render(socket_path, notebook_path, "1", config)
+    shutil.rmtree(tmp_path / "images")
+
+    response = request_render(socket_path, notebook_path, "1", config)
+    (image,) = (tmp_path / "images").iterdir()
+    assert f"{{images/{image.name}}}" in response["output"]
+
+
+def test_render_from_other_directory(server, socket_path, tmp_path, monkeypatch):
+    notebook_path = _image_notebook(tmp_path)
+    config = {"image-dir": "images"}
+    for project in ("project1", "project2"):
+        project_dir = tmp_path / project
+        project_dir.mkdir()
+        monkeypatch.chdir(project_dir)
+        request_render(socket_path, notebook_path, "1", config)
+        # each project got its image
+        assert len(list((project_dir / "images").iterdir())) == 1
+
+
+def test_render_memory_bounded(server, socket_path, notebook_path, monkeypatch):
+    monkeypatch.setattr(jupynotex, "DAEMON_MAX_NOTEBOOKS", 2)
+    monkeypatch.setattr(jupynotex, "DAEMON_MAX_RENDERED_CELLS", 2)
+    request_render(socket_path, notebook_path, "1-3", {})
+    ((_, nb),) = server.notebooks.values()
+    assert len(nb._rendered) == 2
+
+    for limit in ("10", "20", "30"):
+        request_render(socket_path, notebook_path, "1", {"output-text-limit": limit})
+    assert len(server.notebooks) == 2
+
+
+def test_render_problem(server, socket_path, notebook_path):
+    response = request_render(socket_path, notebook_path, "1,x", {})
+    assert response["output"] == ""
+    assert "Found forbidden characters" in response["errors"]
+
+
+def test_render_timing(server, socket_path, notebook_path):
+    response = request_render(socket_path, notebook_path, "1-2", {"timing": "1"})
+    assert "print(1)" in response["output"]
+    assert "jupynotex timing for" in response["errors"]
+    assert "cell 2" in response["errors"]
+
+
+def test_client_uses_daemon(server, notebook_path, capsys):
+    with patch.object(jupynotex, "main") as main_mock:
+        client_main(notebook_path, "2", {})
+    assert main_mock.call_count == 0
+    assert "print(2)" in capsys.readouterr().out
+
+
+def test_client_fallback(socket_path, notebook_path, capsys):
+    client_main(notebook_path, "2", {})
+    client_output = capsys.readouterr().out
+    main(notebook_path, "2", {})
+    assert client_output == capsys.readouterr().out
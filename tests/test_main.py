@@ -3,13 +3,14 @@
 # Licensed under Apache 2.0
 
 import json
+import re
 import textwrap
 from unittest.mock import patch
 
 import pytest
 
 import jupynotex
-from jupynotex import main, Notebook
+from jupynotex import latex_escape, main, render_chunks, Notebook
 
 
 class FakeNotebook:
@@ -117,7 +118,7 @@ def test_simple_error(monkeypatch, capsys, save_notebook):
     notebook_path = save_notebook([("foo", "bar")])
     monkeypatch.setattr(jupynotex, 'FORMAT_ERROR', 'testformat')
 
-    with patch.object(Notebook, "get", side_effect=ValueError("test problem")):
+    with patch.object(Notebook, "get_lines", side_effect=ValueError("test problem")):
         main(notebook_path, '1', {})
 
     # verify the beginning and the end, as the middle part is specific to the environment
@@ -138,6 +139,28 @@ def test_simple_error(monkeypatch, capsys, save_notebook):
     assert err[-1] == "ValueError: test problem"
 
 
+def test_malformed_output_error_box(monkeypatch, capsys, tmp_path):
+    monkeypatch.setattr(jupynotex, 'FORMAT_OK', 'testformat')
+    monkeypatch.setattr(jupynotex, 'FORMAT_ERROR', 'testerrorformat')
+    cells = [
+        {'cell_type': 'code', 'source': ['bad'], 'outputs': [{'output_type': 'display_data'}]},
+        {'cell_type': 'code', 'source': ['good'], 'outputs': []},
+    ]
+    notebook_path = tmp_path / "testnotebook.ipynb"
+    notebook_path.write_text(json.dumps(
+        {'cells': cells, 'metadata': {'language_info': {'name': None}}}))
+
+    main(notebook_path, '1-2', {})
+
+    outerr = capsys.readouterr()
+    titles = re.findall(r"\[(\w+), breakable, title=(.*)\]", outerr.out)
+    assert titles == [
+        ("testerrorformat", "ERROR when parsing cell 1"),
+        ("testformat", "Cell 02"),
+    ]
+    assert outerr.err.strip().split("\n")[-1] == "KeyError: 'data'"
+
+
 def test_multiple(capsys, save_notebook):
     notebook_path = save_notebook([
         ("test cell content up", "test cell content down"),
@@ -263,6 +286,95 @@ def test_title_filename_weirdchars(capsys, save_notebook):
     assert expected == capsys.readouterr().out
 
 
+def test_render_chunks(capsys, save_notebook):
+    notebook_path = save_notebook([
+        ("test cell content up", "test cell content down"),
+        ("other cell content up", "other cell content down"),
+    ])
+
+    nb = Notebook(notebook_path, {})
+    chunks = render_chunks(nb, notebook_path, '1-2', {})
+    assert next(chunks) == "\\begin{tcolorbox}[testformat, breakable, title=Cell 01]\n"
+    chunks = list(chunks)
+    assert all(chunk.endswith("\n") for chunk in chunks)
+
+    main(notebook_path, '1-2', {})
+    assert capsys.readouterr().out.endswith("".join(chunks))
+
+
+def _write_notebook(path, cells):
+    """Write a notebook with the given cells."""
+    path.write_text(json.dumps({'cells': cells, 'metadata': {'language_info': {'name': None}}}))
+    return path
+
+
+def _stream_cell(idx):
+    """Build a code cell with some lines of stream output."""
+    return {
+        'cell_type': 'code',
+        'source': [f'print({idx})'],
+        'outputs': [
+            {'output_type': 'stream', 'text': [f"cell {idx} line {x}\n" for x in range(5)]},
+        ],
+    }
+
+
+def test_render_workers_same_output(capsys, tmp_path):
+    notebook_path = _write_notebook(tmp_path / "test.ipynb", [_stream_cell(x) for x in range(20)])
+
+    main(notebook_path, '1-', {})
+    sequential = capsys.readouterr().out
+    (tmp_path / "jupynotex-cache").rename(tmp_path / "sequential-cache")
+
+    # rendered by the workers, not in this process
+    with patch.object(Notebook, "_proc_src", side_effect=Notebook._proc_src, autospec=True) as m:
+        main(notebook_path, '1-', {"render-workers": "4"})
+    assert m.call_count == 0
+    assert capsys.readouterr().out == sequential
+
+
+def test_render_workers_only_not_cached(capsys, tmp_path):
+    notebook_path = _write_notebook(tmp_path / "test.ipynb", [_stream_cell(x) for x in range(4)])
+    main(notebook_path, '1-', {})
+    capsys.readouterr()
+
+    with patch("concurrent.futures.ProcessPoolExecutor") as executor_mock:
+        main(notebook_path, '1-', {"render-workers": "4"})
+    assert executor_mock.call_count == 0
+    assert "title=Cell 04" in capsys.readouterr().out
+
+
+def test_render_workers_error(monkeypatch, capsys, tmp_path):
+    monkeypatch.setattr(jupynotex, 'FORMAT_ERROR', 'testerrorformat')
+    cells = [_stream_cell(1), _stream_cell(2), _stream_cell(3)]
+    cells[1]['outputs'] = [{'output_type': 'display_data'}]
+    notebook_path = _write_notebook(tmp_path / "test.ipynb", cells)
+
+    main(notebook_path, '1-3', {"render-workers": "3"})
+
+    outerr = capsys.readouterr()
+    titles = re.findall(r"breakable, title=(.*)\]", outerr.out)
+    assert titles == ["Cell 01", "ERROR when parsing cell 2", "Cell 03"]
+    assert "[testerrorformat, breakable, title=ERROR when parsing cell 2]" in outerr.out
+    assert outerr.err.strip().split("\n")[-1] == "KeyError: 'data'"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("", ""),
+    ("nothing special", "nothing special"),
+    ("50% of a_b", r"50\% of a\_b"),
+    ("& % $ # _ { } ~ ^", r"\& \% \$ \# \_ \{ \} \textasciitilde \textasciicircum"),
+    ("\\{x}", r"\textbackslash\{x\}"),
+])
+def test_latex_escape(text, expected):
+    assert latex_escape(text) == expected
+
+
+def test_latex_escape_untouched():
+    text = "nothing special " * 1000
+    assert latex_escape(text) is text
+
+
 def test_partial_only_input(capsys, save_notebook):
     notebook_path = save_notebook([
         ("test cell content up", "test cell content down"),
@@ -291,3 +403,53 @@ def test_partial_only_output(capsys, save_notebook):
 
     """)
     assert expected == capsys.readouterr().out
+
+
+def test_timing_disabled(monkeypatch, capsys, save_notebook):
+    monkeypatch.delenv("JUPYNOTEX_TIMING", raising=False)
+    notebook_path = save_notebook([
+        ("test cell content up", "test cell content down"),
+    ])
+
+    main(notebook_path, '1', {})
+    assert capsys.readouterr().err == ""
+
+
+def test_timing_stderr(monkeypatch, capsys, save_notebook):
+    monkeypatch.delenv("JUPYNOTEX_TIMING", raising=False)
+    notebook_path = save_notebook([
+        ("test cell content up", "test cell content down"),
+        ("other cell content up", "other cell content down"),
+    ])
+
+    main(notebook_path, '1-2', {"timing": "1"})
+    captured = capsys.readouterr()
+    assert "\\begin{tcolorbox}" in captured.out
+    assert "jupynotex" not in captured.out
+    report = captured.err.splitlines()
+    assert report[0].startswith(f"jupynotex timing for {notebook_path} (total ")
+    phases = [line.split()[0] for line in report[1:]]
+    assert phases[:3] == ["load", "parse_cells", "convert_svgs"]
+    assert "mimetype text/plain" in captured.err
+    assert "rendered cells cache: 0 hits, 2 misses" in captured.err
+
+
+def test_timing_env_json(monkeypatch, capsys, save_notebook, tmp_path):
+    json_path = tmp_path / "timing.jsonl"
+    monkeypatch.setenv("JUPYNOTEX_TIMING", str(json_path))
+    notebook_path = save_notebook([
+        ("test cell content up", "test cell content down"),
+    ])
+
+    main(notebook_path, '1', {})
+    main(notebook_path, '1', {})
+    assert "jupynotex timing" in capsys.readouterr().err
+
+    first, second = [json.loads(line) for line in json_path.read_text().splitlines()]
+    assert first["notebook"] == str(notebook_path)
+    assert first["rendered cells cache"] == "0 hits, 1 misses"
+    assert second["rendered cells cache"] == "1 hits, 0 misses"
+    names = [phase["name"] for phase in first["phases"]]
+    assert names == ["load", "parse_cells", "convert_svgs", "mimetype text/plain", "cell 1"]
+    assert all(phase["calls"] == 1 and phase["total"] >= 0 for phase in first["phases"])
+    assert first["total"] >= first["phases"][-1]["total"]
@@ -3,17 +3,24 @@
 # Licensed under Apache 2.0
 
 import base64
+import binascii
+import hashlib
+import io
 import json
 import os
 import pathlib
 import re
+import sys
 import tempfile
 import textwrap
+import threading
+import tracemalloc
 from unittest.mock import patch
 
 import pytest
 
-from jupynotex import Notebook, HIGHLIGHTERS
+import jupynotex
+from jupynotex import HIGHLIGHTERS, WRAP_MARK, ImageStore, Notebook, _detect_svg_converter
 
 
 @pytest.fixture
@@ -81,6 +88,76 @@ def test_source_code_highlighted(notebook, monkeypatch):
     assert src == expected
 
 
+def _pygments_notebook(tmp_path, cells, lang_name='python'):
+    """Write the notebook and load it highlighting with Pygments."""
+    path = tmp_path / "test.ipynb"
+    content = {'cells': cells, 'metadata': {'language_info': {'name': lang_name}}}
+    path.write_text(json.dumps(content), encoding='utf8')
+    return Notebook(path, {"highlighter": "pygments"})
+
+
+def test_source_code_pygments(tmp_path):
+    pytest.importorskip("pygments")
+    rawcell = {
+        'cell_type': 'code',
+        'source': ['def f(x):  \n', '    return {"a": x}  # 50%\n'],
+    }
+    nb = _pygments_notebook(tmp_path, [rawcell])
+
+    src, _ = nb.get(1)
+    lines = src.split("\n")
+    assert lines[0] == r"\begin{Verbatim}[commandchars=\\\{\},fontsize=\footnotesize]"
+    assert lines[1] == r"\PY{k}{def}\PY{+w}{ }\PY{n+nf}{f}\PY{p}{(}\PY{n}{x}\PY{p}{)}\PY{p}{:}"
+    assert r"\PY{c+c1}{\PYZsh{} 50\PYZpc{}}" in lines[2]
+    assert lines[3:] == [r"\end{Verbatim}"]
+
+
+def test_source_code_pygments_cached(tmp_path):
+    pytest.importorskip("pygments")
+    rawcell = {'cell_type': 'code', 'source': ['x = 1\n']}
+    nb = _pygments_notebook(tmp_path, [rawcell, dict(rawcell, outputs=[])])
+    src1, _ = nb.get(1)
+
+    # a different cell (not in the render cache) but with the same source
+    with patch("pygments.highlight", side_effect=ValueError("should not be called")):
+        src2, _ = nb.get(2)
+    assert src1 == src2
+
+
+def test_source_code_pygments_unknown_language(tmp_path):
+    pytest.importorskip("pygments")
+    rawcell = {'cell_type': 'code', 'source': ['line1\n']}
+    nb = _pygments_notebook(tmp_path, [rawcell], lang_name='testlang-unknown')
+
+    src, _ = nb.get(1)
+    assert src.split("\n") == jupynotex.VERBATIM_BEGIN + ["line1"] + jupynotex.VERBATIM_END
+
+
+def test_source_code_pygments_missing(tmp_path, monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "pygments", None)  # can not be imported
+    jupynotex._pygments_version.cache_clear()
+    rawcell = {'cell_type': 'code', 'source': ['line1\n']}
+    nb = _pygments_notebook(tmp_path, [rawcell])
+    jupynotex._pygments_version.cache_clear()
+
+    src, _ = nb.get(1)
+    begin, end = HIGHLIGHTERS['python']
+    assert src.split("\n") == begin + ["line1"] + end
+    assert not nb.highlights_with_pygments
+    assert "Pygments is needed" in capsys.readouterr().err
+
+
+def test_source_code_pygments_style_defined(tmp_path):
+    pytest.importorskip("pygments")
+    rawcell = {'cell_type': 'code', 'source': ['x = 1\n']}
+    nb = _pygments_notebook(tmp_path, [rawcell])
+
+    rendered = "".join(jupynotex.render_chunks(nb, tmp_path / "test.ipynb", "1", {}))
+    style_defs, cells = rendered.split(r"\begin{tcolorbox}", 1)
+    assert r"\def\PY#1#2" in style_defs
+    assert r"\PY{n}{x}" in cells
+
+
 def test_source_markdown_ignored(notebook):
     rawcell = {
         'cell_type': 'markdown',
@@ -208,6 +285,227 @@ def test_output_simple_executeresult_png(notebook):
     assert pathlib.Path(fpath).read_bytes() == raw_content
 
 
+def test_output_png_deduplicated(notebook, isolated_images):
+    raw_content = b"\x01\x02 asdlklda3wudghlaskgdlask"
+    rawcell = {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {
+                    'image/png': base64.b64encode(raw_content).decode('ascii'),
+                },
+            },
+        ],
+    }
+    nb = notebook([rawcell, rawcell])
+
+    _, out1 = nb.get(1)
+    _, out2 = nb.get(2)
+    assert out1 == out2
+
+    # only one file, named after its content, in the images directory
+    (stored,) = isolated_images.iterdir()
+    assert stored.name == hashlib.sha256(raw_content).hexdigest() + ".png"
+    assert stored.read_bytes() == raw_content
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 4, 7, 64, 1024])
+def test_base64_decoded_in_chunks(monkeypatch, chunk_size):
+    monkeypatch.setattr(jupynotex, "BASE64_CHUNK_SIZE", chunk_size)
+    raw_content = bytes(range(256)) * 3 + b"end"
+    encoded = base64.encodebytes(raw_content).decode("ascii")  # with line breaks
+    decoded = b"".join(jupynotex._base64_decoded_chunks(encoded))
+    assert decoded == raw_content == base64.b64decode(encoded)
+
+
+def test_base64_decoded_in_chunks_bad_padding():
+    with pytest.raises(ValueError):
+        list(jupynotex._base64_decoded_chunks("AQID" + "AQ"))
+
+
+def test_imagestore_base64_not_rewritten(tmp_path, monkeypatch):
+    store = ImageStore(tmp_path)
+    encoded = base64.b64encode(b"some image").decode("ascii")
+    path = store.store_base64(encoded, ".png")
+    assert path == tmp_path / (hashlib.sha256(b"some image").hexdigest() + ".png")
+    assert path.read_bytes() == b"some image"
+
+    inode = path.stat().st_ino
+    assert store.store_base64(encoded, ".png") == path
+    assert path.stat().st_ino == inode  # not replaced
+    assert [p.name for p in tmp_path.iterdir()] == [path.name]
+
+
+def test_imagestore_base64_bad_data(tmp_path):
+    store = ImageStore(tmp_path)
+    with pytest.raises(binascii.Error):
+        store.store_base64("not base64!", ".png")
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_output_png_memory_bounded(isolated_images):
+    raw_content = os.urandom(8 * 1024 * 1024)
+    encoded = base64.encodebytes(raw_content).decode("ascii")
+    processor = jupynotex.ItemProcessor({}, {}, ImageStore(isolated_images))
+
+    tracemalloc.start()
+    try:
+        path = processor.process_png(encoded)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert pathlib.Path(path).read_bytes() == raw_content
+    # the image is decoded in chunks, never completely in memory
+    assert peak < 1024 * 1024
+
+
+def test_output_png_custom_image_dir(notebook, tmp_path):
+    raw_content = b"\x01\x02 asdlklda3wudghlaskgdlask"
+    rawcell = {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {
+                    'image/png': base64.b64encode(raw_content).decode('ascii'),
+                },
+            },
+        ],
+    }
+    nb = notebook([rawcell])
+    nb.image_store = ImageStore(tmp_path / "custom")
+
+    _, out = nb.get(1)
+    m = re.match(r'\\includegraphics\[width=1\\textwidth\]\{(.+)\}', out)
+    (fpath,) = m.groups()
+    assert pathlib.Path(fpath).parent == tmp_path / "custom"
+
+
+def _png_cell(raw_content):
+    return {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {'image/png': base64.b64encode(raw_content).decode('ascii')},
+            },
+        ],
+    }
+
+
+def _png_image(width, height, noise=False):
+    pil_image = pytest.importorskip("PIL.Image")
+    if noise:
+        image = pil_image.frombytes("RGB", (width, height), os.urandom(width * height * 3))
+    else:
+        image = pil_image.new("RGB", (width, height), (200, 30, 30))
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _stored_image(out):
+    (fpath,) = re.match(r'\\includegraphics\[width=.+?\]\{(.+)\}', out).groups()
+    return pathlib.Path(fpath)
+
+
+@pytest.mark.parametrize("image_size, dpi, expected", [
+    ("50mm", 254, 500),
+    ("2in", 100, 200),
+    (" 5 cm ", 100, 197),
+    ("72.27pt", 150, 150),
+    (".5in", 10, 5),
+    (r"1\textwidth", 100, None),
+    ("50mm", None, None),
+    (None, 100, None),
+])
+def test_image_target_width(image_size, dpi, expected):
+    assert jupynotex._target_width(image_size, dpi) == expected
+
+
+def test_output_png_optimize_without_pillow(notebook, isolated_images, monkeypatch, capsys):
+    monkeypatch.setitem(sys.modules, "PIL", None)  # can not be imported
+    jupynotex._warn_no_pillow.cache_clear()
+    raw_content = b"\x01\x02 asdlklda3wudghlaskgdlask"
+    nb = notebook([_png_cell(raw_content)])
+    nb.config_options = {"image-dpi": 100}
+    nb.parse_cells("1, output-image-size=50mm")
+
+    _, out = nb.get(1)
+    assert _stored_image(out).read_bytes() == raw_content
+    assert "Pillow is needed" in capsys.readouterr().err
+
+
+def test_output_png_downscaled(notebook):
+    Image = pytest.importorskip("PIL.Image")
+    nb = notebook([_png_cell(_png_image(2000, 1000))])
+    nb.config_options = {"image-dpi": 254}
+    nb.parse_cells("1, output-image-size=50mm")
+
+    _, out = nb.get(1)
+    assert out.startswith(r"\includegraphics[width=50mm]")
+    stored = _stored_image(out)
+    assert stored.suffix == ".png"
+    assert Image.open(stored).size == (500, 250)
+
+
+def test_output_png_not_upscaled(notebook, isolated_images):
+    raw_content = _png_image(200, 100)
+    nb = notebook([_png_cell(raw_content)])
+    nb.config_options = {"image-dpi": 254}
+    nb.parse_cells("1, output-image-size=50mm")
+
+    _, out = nb.get(1)
+    assert _stored_image(out).read_bytes() == raw_content
+
+
+def test_output_png_relative_size_not_downscaled(notebook):
+    raw_content = _png_image(2000, 1000)
+    nb = notebook([_png_cell(raw_content)])
+    nb.config_options = {"image-dpi": 254}
+
+    _, out = nb.get(1)
+    assert _stored_image(out).read_bytes() == raw_content
+
+
+def test_output_png_photographic_as_jpeg(notebook):
+    Image = pytest.importorskip("PIL.Image")
+    nb = notebook([_png_cell(_png_image(300, 200, noise=True))])
+    nb.config_options = {"image-jpeg-quality": 80}
+
+    _, out = nb.get(1)
+    stored = _stored_image(out)
+    assert stored.suffix == ".jpg"
+    assert Image.open(stored).format == "JPEG"
+
+
+def test_output_png_flat_kept(notebook):
+    raw_content = _png_image(300, 200)
+    nb = notebook([_png_cell(raw_content)])
+    nb.config_options = {"image-jpeg-quality": 80}
+
+    _, out = nb.get(1)
+    assert _stored_image(out).read_bytes() == raw_content
+
+
+def test_output_png_optimization_cached(notebook):
+    Image = pytest.importorskip("PIL.Image")
+    nb = notebook([_png_cell(_png_image(2000, 1000))])
+    nb.config_options = {"image-dpi": 254}
+    nb.parse_cells("1, output-image-size=50mm")
+    _, out1 = nb.get(1)
+
+    with patch.object(Image, "open") as open_mock:
+        optimized = jupynotex._optimize_png(_png_image(2000, 1000), 500, None)
+    assert open_mock.call_count == 0
+    assert optimized.name == _stored_image(out1).name
+
+
 def test_output_simple_executeresult_svg(notebook):
     rawcell = {
         'cell_type': 'code',
@@ -240,6 +538,7 @@ def test_output_simple_executeresult_svg(notebook):
         with open(src_fpath, 'rb') as fh:
             content = fh.read()
         assert content == b'xml svg stuff\nmore svg stuff\n'
+        pathlib.Path(dst_fpath).write_bytes(b"fake pdf")
 
     with patch('subprocess.run', fake_run):
         _, out = nb.get(1)
@@ -247,7 +546,394 @@ def test_output_simple_executeresult_svg(notebook):
     assert m
     (fpath,) = m.groups()
     assert "\\" not in fpath  # no backslashes in Windows
-    assert pathlib.Path(fpath) == pathlib.Path(dst_fpath)
+    assert pathlib.Path(fpath).read_bytes() == b"fake pdf"
+    # converted to a temporary file, then moved in place
+    assert pathlib.Path(dst_fpath).name.startswith(pathlib.Path(fpath).name + ".")
+    assert not pathlib.Path(dst_fpath).exists()
+
+
+def test_output_svg_concurrent_conversions(notebook):
+    raw_svg = b"svg stuff"
+    key = jupynotex.DiskCache.build_key(raw_svg, *jupynotex.SVG_TO_PDF_FLAGS)
+    final_path = jupynotex.DiskCache(jupynotex._cache_dir()).path_for(key, '.pdf')
+    nested_results = []
+    calls = []
+
+    def fake_run(cmd):
+        calls.append(cmd)
+        dst_fpath = pathlib.Path(cmd[3][len('--export-filename='):])
+        dst_fpath.write_bytes(b"%PDF-partial")
+        if len(calls) == 1:
+            # other conversion of the same image while this one is not finished
+            assert not final_path.exists()
+            other = threading.Thread(target=lambda: nested_results.append(
+                jupynotex._convert_svg(raw_svg, "inkscape").read_bytes()))
+            other.start()
+            other.join()
+            assert pathlib.Path(cmd[4]).exists()  # its SVG was not removed by the other one
+        dst_fpath.write_bytes(b"%PDF-complete")
+
+    with patch('subprocess.run', fake_run):
+        pdf_path = jupynotex._convert_svg(raw_svg, "inkscape")
+    assert nested_results == [b"%PDF-complete"]
+    assert pdf_path == final_path
+    assert pdf_path.read_bytes() == b"%PDF-complete"
+    assert [path.name for path in final_path.parent.iterdir()] == [final_path.name]
+
+
+def test_output_svg_cached(notebook):
+    rawcell = {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {
+                    'image/svg+xml': ['xml svg stuff\n', 'more svg stuff\n'],
+                },
+            },
+        ],
+    }
+    nb = notebook([rawcell])
+    called = []
+
+    def fake_run(cmd):
+        """Simulate the subprocess run, creating the destination file."""
+        called.append(cmd)
+        dst_fpath = cmd[3][len('--export-filename='):]
+        pathlib.Path(dst_fpath).write_bytes(b"fake pdf")
+
+    with patch('subprocess.run', fake_run):
+        _, out1 = nb.get(1)
+        _, out2 = nb.get(1)
+
+    # converted only once, the second time just reused the result
+    assert len(called) == 1
+    assert out1 == out2
+
+
+def test_output_svg_not_cached_if_conversion_failed(notebook):
+    rawcell = {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {
+                    'image/svg+xml': ['xml svg stuff\n', 'more svg stuff\n'],
+                },
+            },
+        ],
+    }
+    nb = notebook([rawcell])
+    called = []
+
+    with patch('subprocess.run', called.append):
+        with pytest.raises(ValueError):
+            nb.get(1)
+        with pytest.raises(ValueError):
+            nb.get(1)
+
+    # as nothing was produced, it was tried both times
+    assert len(called) == 2
+
+
+def _svgcell(content):
+    """Build a cell with a SVG output."""
+    return {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {'image/svg+xml': [content]},
+            },
+        ],
+    }
+
+
+class FakeInkscape:
+    """Simulate the inkscape runs, both individually and in shell mode, recording conversions.
+
+    If 'shell_works' is False, the shell mode finishes without converting anything.
+    """
+
+    def __init__(self, shell_works=True):
+        self.shell_works = shell_works
+        self.shell_calls = 0
+        self.converted = []
+
+    def _convert(self, src_fpath, dst_fpath):
+        self.converted.append(pathlib.Path(src_fpath).read_text())
+        pathlib.Path(dst_fpath).write_bytes(b"fake pdf")
+
+    def __call__(self, cmd, input=None, **kwargs):
+        assert cmd[0] == 'inkscape'
+        if cmd[1] != '--shell':
+            self._convert(cmd[4], cmd[3][len('--export-filename='):])
+            return
+
+        self.shell_calls += 1
+        if not self.shell_works:
+            return
+        commands = input.split('\n')
+        assert commands[-1] == 'quit'
+        for command in commands[:-1]:
+            actions = command.split(';')
+            assert actions[1:3] == ['export-text-to-path', 'export-type:pdf']
+            assert actions[-2:] == ['export-do', 'file-close']
+            src_fpath = actions[0][len('file-open:'):]
+            dst_fpath = actions[3][len('export-filename:'):]
+            self._convert(src_fpath, dst_fpath)
+
+
+def test_convert_svgs_selected_cells(notebook):
+    nb = notebook([_svgcell("svg 1"), _svgcell("svg 2"), _svgcell("svg 3"), _svgcell("svg 1")])
+    nb.config_options = {"svg-workers": 2}
+    fake_inkscape = FakeInkscape()
+
+    # the second cell is not converted as it's not selected, and the last one
+    # is the same image than the first one
+    cells = nb.parse_cells("1,3-4")
+    with patch('subprocess.run', fake_inkscape):
+        nb.convert_svgs(cells)
+    assert sorted(fake_inkscape.converted) == ["svg 1", "svg 3"]
+
+    # later processing reuses the conversions
+    with patch('subprocess.run', fake_inkscape):
+        for cell in cells:
+            nb.get(cell.index)
+    assert sorted(fake_inkscape.converted) == ["svg 1", "svg 3"]
+
+
+def test_svg_converter_rsvg(notebook):
+    nb = notebook([_svgcell("svg 1"), _svgcell("svg 2")])
+    nb.config_options = {"svg-converter": "rsvg-convert", "svg-workers": 1}
+    commands = []
+
+    def fake_run(cmd):
+        commands.append(cmd[:2])
+        assert cmd[2].startswith('--output=')
+        content = pathlib.Path(cmd[3]).read_text()
+        pathlib.Path(cmd[2][len('--output='):]).write_text(f"pdf from {content}")
+
+    # converted one by one, as there is no batch mode
+    cells = nb.parse_cells("1-2")
+    with patch('subprocess.run', fake_run):
+        nb.convert_svgs(cells)
+    assert commands == [['rsvg-convert', '--format=pdf']] * 2
+
+    _, out = nb.get(2)
+    assert _stored_image(out).read_text() == "pdf from svg 2"
+    assert len(commands) == 2
+
+
+def test_svg_converter_cairosvg(notebook, monkeypatch):
+    class FakeCairoSVG:
+        @staticmethod
+        def svg2pdf(url, write_to):
+            pathlib.Path(write_to).write_bytes(b"pdf from " + pathlib.Path(url).read_bytes())
+
+    monkeypatch.setitem(sys.modules, "cairosvg", FakeCairoSVG)
+    nb = notebook([_svgcell("svg 1")])
+    nb.config_options = {"svg-converter": "cairosvg"}
+
+    with patch('subprocess.run', side_effect=ValueError("should not be called")):
+        _, out = nb.get(1)
+    assert _stored_image(out).read_bytes() == b"pdf from svg 1"
+
+
+def test_svg_converter_failed_reported(notebook):
+    nb = notebook([_svgcell("svg 1")])
+    nb.config_options = {"svg-converter": "rsvg-convert"}
+
+    with patch('subprocess.run'):  # nothing is produced
+        with pytest.raises(ValueError, match=re.escape("(check rsvg-convert)")):
+            nb.get(1)
+
+
+def test_svg_converter_cache_per_converter(notebook):
+    raw_svg = b"svg 1"
+    with patch('subprocess.run', FakeInkscape()):
+        inkscape_path = jupynotex._convert_svg(raw_svg, "inkscape")
+    with patch('subprocess.run', lambda cmd: pathlib.Path(cmd[2][9:]).write_bytes(b"pdf")):
+        rsvg_path = jupynotex._convert_svg(raw_svg, "rsvg-convert")
+    assert inkscape_path != rsvg_path
+
+
+@pytest.mark.parametrize("installed, expected", [
+    ({"inkscape", "rsvg-convert", "cairosvg"}, "inkscape"),
+    ({"rsvg-convert", "cairosvg"}, "rsvg-convert"),
+    ({"cairosvg"}, "cairosvg"),
+    (set(), "inkscape"),
+])
+def test_svg_converter_detection(monkeypatch, installed, expected):
+    monkeypatch.setattr("shutil.which", lambda name: name if name in installed else None)
+    monkeypatch.setattr(
+        "importlib.util.find_spec", lambda name: name if name in installed else None)
+    assert _detect_svg_converter.__wrapped__() == expected
+
+
+def _multiformat_cell(svg_content, raw_pdf, raw_png):
+    """Build a cell with an image output in several formats."""
+    return {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {
+                    'image/png': base64.b64encode(raw_png).decode('ascii'),
+                    'image/svg+xml': [svg_content],
+                    'application/pdf': base64.b64encode(raw_pdf).decode('ascii'),
+                    'text/plain': ['<Figure>'],
+                },
+            },
+        ],
+    }
+
+
+def test_output_pdf_preferred(notebook):
+    nb = notebook([_multiformat_cell("svg 1", b"%PDF- fake pdf", b"fake png")])
+    fake_inkscape = FakeInkscape()
+
+    cells = nb.parse_cells("1")
+    with patch('subprocess.run', fake_inkscape):
+        nb.convert_svgs(cells)
+        _, out = nb.get(1)
+    assert fake_inkscape.converted == []
+    stored = _stored_image(out)
+    assert stored.suffix == ".pdf"
+    assert stored.read_bytes() == b"%PDF- fake pdf"
+
+
+def test_output_jpeg(notebook):
+    rawcell = {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {
+                    'image/jpeg': base64.b64encode(b"fake jpeg").decode('ascii'),
+                    'text/plain': ['<Figure>'],
+                },
+            },
+        ],
+    }
+    nb = notebook([rawcell])
+
+    _, out = nb.get(1)
+    stored = _stored_image(out)
+    assert stored.suffix == ".jpg"
+    assert stored.read_bytes() == b"fake jpeg"
+
+
+def test_output_mimetype_priority(notebook):
+    nb = notebook([_multiformat_cell("svg 1", b"%PDF- fake pdf", b"fake png")])
+    nb.config_options = {"mimetype-priority": ["image/png", "image/svg+xml"]}
+
+    _, out = nb.get(1)
+    stored = _stored_image(out)
+    assert stored.suffix == ".png"
+    assert stored.read_bytes() == b"fake png"
+
+
+def test_output_mimetype_priority_svg(notebook):
+    nb = notebook([_multiformat_cell("svg 1", b"%PDF- fake pdf", b"fake png")])
+    nb.config_options = {"mimetype-priority": ["image/svg+xml"], "svg-workers": 1}
+    fake_inkscape = FakeInkscape()
+
+    cells = nb.parse_cells("1")
+    with patch('subprocess.run', fake_inkscape):
+        nb.convert_svgs(cells)
+    assert fake_inkscape.converted == ["svg 1"]
+
+
+def test_select_mimetype_priority():
+    data = {'text/plain': [], 'image/png': "", 'image/jpeg': ""}
+    assert jupynotex.ItemProcessor.select_mimetype(data)[0] == 'image/png'
+    priority = ['image/jpeg']
+    assert jupynotex.ItemProcessor.select_mimetype(data, priority)[0] == 'image/jpeg'
+    priority = ['text/plain', 'image/jpeg']
+    assert jupynotex.ItemProcessor.select_mimetype(data, priority)[0] == 'text/plain'
+    priority = ['application/pdf']
+    assert jupynotex.ItemProcessor.select_mimetype(data, priority)[0] == 'image/png'
+
+
+def test_convert_svgs_batched(notebook):
+    nb = notebook([_svgcell("svg 1"), _svgcell("svg 2"), _svgcell("svg 3")])
+    nb.config_options = {"svg-workers": 1}
+    fake_inkscape = FakeInkscape()
+
+    cells = nb.parse_cells("1-3")
+    with patch('subprocess.run', fake_inkscape):
+        nb.convert_svgs(cells)
+
+    # all done by the same process
+    assert fake_inkscape.shell_calls == 1
+    assert sorted(fake_inkscape.converted) == ["svg 1", "svg 2", "svg 3"]
+
+
+def test_convert_svgs_batched_fallback(notebook):
+    nb = notebook([_svgcell("svg 1"), _svgcell("svg 2")])
+    nb.config_options = {"svg-workers": 1}
+    fake_inkscape = FakeInkscape(shell_works=False)
+
+    cells = nb.parse_cells("1-2")
+    with patch('subprocess.run', fake_inkscape):
+        nb.convert_svgs(cells)
+
+    # the shell was tried, but all ended converted individually
+    assert fake_inkscape.shell_calls == 1
+    assert sorted(fake_inkscape.converted) == ["svg 1", "svg 2"]
+
+
+def test_convert_svgs_input_only_cells(notebook):
+    nb = notebook([_svgcell("svg 1"), _svgcell("svg 2")])
+    fake_inkscape = FakeInkscape()
+
+    with patch('subprocess.run', fake_inkscape):
+        rendered = "".join(jupynotex.render_chunks(nb, nb._notebook_path, "1i,2", {}))
+    assert fake_inkscape.converted == ["svg 2"]
+    assert rendered.count("includegraphics") == 1
+
+
+def _count_outputs_parsing(monkeypatch):
+    """Count how many times the raw outputs of a cell (from the index) are parsed."""
+    parsed = []
+    original_loads = json.loads
+
+    def _loads(raw, *args, **kwargs):
+        if isinstance(raw, bytes):
+            parsed.append(raw)
+        return original_loads(raw, *args, **kwargs)
+
+    monkeypatch.setattr(jupynotex.json, "loads", _loads)
+    return parsed
+
+
+def test_convert_svgs_outputs_parsed_once(monkeypatch, tmp_path):
+    monkeypatch.setattr(jupynotex, "PARSED_CACHE_MIN_SIZE", 0)
+    path = tmp_path / "big.ipynb"
+    cells = [_svgcell("svg 1"), _text_cell("text"), _svgcell("svg 2")]
+    path.write_text(json.dumps({'cells': cells, 'metadata': {'language_info': {'name': None}}}))
+    fake_inkscape = FakeInkscape()
+
+    # the first time each cell's outputs are parsed only once, when converting or rendering
+    nb = Notebook(path, {})
+    parsed = _count_outputs_parsing(monkeypatch)
+    with patch('subprocess.run', fake_inkscape):
+        "".join(jupynotex.render_chunks(nb, path, "1-3", {}))
+    assert len(parsed) == 3
+    assert sorted(fake_inkscape.converted) == ["svg 1", "svg 2"]
+
+    # all cells are already rendered, so no outputs are parsed at all
+    nb = Notebook(path, {})
+    parsed.clear()
+    "".join(jupynotex.render_chunks(nb, path, "1-3", {}))
+    assert parsed == []
+    assert (nb.render_cache.hits, nb.render_cache.misses) == (3, 0)
 
 
 def test_output_simple_stream(notebook):
@@ -525,6 +1211,170 @@ def test_output_indented(notebook):
     assert out == expected
 
 
+def test_output_wrapped_long_words(notebook):
+    rawcell = {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'stream',
+                'text': [
+                    'short 0123456789012345678901234567890123456789\n',
+                    '\x1b[1mcolored\x1b[0m\ttabbed   spaced    out words here\n',
+                ],
+            },
+        ],
+    }
+    nb = notebook([rawcell])
+    nb.config_options = {"output-text-limit": 20}
+
+    _, out = nb.get(1)
+    expected = textwrap.dedent("""\
+        \\begin{footnotesize}
+        \\begin{verbatim}
+        short 01234567890123
+            ↳ 45678901234567890123
+            ↳ 456789
+        colored tabbed
+            ↳ spaced    out words
+            ↳ here
+        \\end{verbatim}
+        \\end{footnotesize}
+    """).strip()
+    assert out == expected
+
+
+@pytest.mark.parametrize("line", [
+    "This is a very long line that will wrap twice.",
+    "  indented text which is somewhat long, with   several spaces  inside",
+    "averyveryverylongwordthatneedstobesplit in pieces, and  a secondlongwordtoolong",
+    "spaces exactly at the limit: abcdefghi abcdefghi abcdefghi abcdefghi",
+])
+@pytest.mark.parametrize("limit", [3, 7, 10, 20])
+def test_wrap_line_as_textwrap(line, limit):
+    # same result than textwrap, but not splitting on hyphens (and no trailing spaces)
+    expected = [part.rstrip() for part in textwrap.wrap(line, limit, break_on_hyphens=False)]
+    assert list(jupynotex._wrap_line(line, limit)) == expected
+
+
+def test_plain_text_as_string():
+    result = jupynotex._process_plain_text("line 1  \n\x1b[32mline 2\x1b[0m\n")
+    assert result == [*jupynotex.VERBATIM_BEGIN, "line 1", "line 2", "", *jupynotex.VERBATIM_END]
+
+
+def test_plain_text_empty():
+    result = jupynotex._process_plain_text([], {"output-text-limit": 10})
+    assert result == [*jupynotex.VERBATIM_BEGIN, *jupynotex.VERBATIM_END]
+
+
+def _stream_cell(lines):
+    return {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [{'output_type': 'stream', 'text': [f"{line}\n" for line in lines]}],
+    }
+
+
+def test_output_max_lines_global(notebook):
+    nb = notebook([_stream_cell(f"line {idx}" for idx in range(1, 101))])
+    nb.config_options = {"output-max-lines": 5}
+
+    _, out = nb.get(1)
+    expected = textwrap.dedent("""\
+        \\begin{footnotesize}
+        \\begin{verbatim}
+        line 1
+        line 2
+        [... 95 lines not shown ...]
+        line 98
+        line 99
+        line 100
+        \\end{verbatim}
+        \\end{footnotesize}
+    """).strip()
+    assert out == expected
+
+
+def test_output_max_lines_not_exceeded(notebook):
+    nb = notebook([_stream_cell(["line 1", "line 2", "line 3"])])
+    nb.config_options = {"output-max-lines": 3}
+
+    _, out = nb.get(1)
+    assert "not shown" not in out
+    assert "line 1\nline 2\nline 3" in out
+
+
+def test_output_max_lines_cell_overrides(notebook):
+    nb = notebook([_stream_cell(f"line {idx}" for idx in range(1, 101))])
+    nb.config_options = {"output-max-lines": 5}
+    nb.parse_cells("1, output-max-lines=3")
+
+    _, out = nb.get(1)
+    assert "line 1\n[... 97 lines not shown ...]\nline 99\nline 100\n\\end" in out
+
+
+def test_output_max_lines_cell_bad_value(notebook):
+    nb = notebook([_stream_cell(["line"])])
+    nb.parse_cells("1, output-max-lines=foo")
+    with pytest.raises(ValueError):
+        nb.get(1)
+
+
+def test_output_max_bytes(notebook):
+    nb = notebook([_stream_cell(["0123456789"] * 20 + ["the end"])])
+    nb.config_options = {"output-max-bytes": 50}
+
+    _, out = nb.get(1)
+    expected = "0123456789\n0123456789\n[... 17 lines not shown ...]\n0123456789\nthe end\n\\end"
+    assert expected in out
+
+
+def test_output_max_lines_wrapped(notebook):
+    nb = notebook([_stream_cell(["word " * 50])])
+    nb.config_options = {"output-max-lines": 4, "output-text-limit": 10}
+
+    _, out = nb.get(1)
+    assert f"word word\n    {WRAP_MARK} word word\n[... 21 lines not shown ...]\n" in out
+
+
+def test_elided_lines_streaming():
+    consumed = []
+
+    def _lines():
+        for idx in range(10_000):
+            consumed.append(idx)
+            yield f"line {idx}"
+
+    elided = jupynotex._elided_lines(_lines(), 4, None)
+    assert next(elided) == "line 0"
+    assert consumed == [0]  # the first lines are yielded as they come
+    assert list(elided) == ["line 1", "[... 9996 lines not shown ...]", "line 9998", "line 9999"]
+
+
+def test_process_plain_text_memory_bounded():
+    lines = [f"\x1b[32mline {idx}\tof a big training log\x1b[0m\n" for idx in range(200_000)]
+    options = {"output-max-lines": 6, "output-text-limit": 60}
+
+    tracemalloc.start()
+    try:
+        result = jupynotex._process_plain_text(lines, options)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert result[2:-2] == [
+        "line 0  of a big training log",
+        "line 1  of a big training log",
+        "line 2  of a big training log",
+        "[... 199994 lines not shown ...]",
+        "line 199997     of a big training log",
+        "line 199998     of a big training log",
+        "line 199999     of a big training log",
+    ]
+    # the text is processed line by line, never completely in memory
+    assert peak < 256 * 1024
+
+
 def test_configvalidation_empty(tmp_path):
     fake_nb_path = tmp_path / "fake.ipynb"
     content = {'cells': [], 'metadata': {'language_info': {'name': None}}}
@@ -565,6 +1415,72 @@ def test_configvalidation_outputtextlimit_bad(value):
         Notebook("boguspath", {"output-text-limit": value})
 
 
+def test_configvalidation_highlighter(tmp_path):
+    fake_nb_path = tmp_path / "fake.ipynb"
+    content = {'cells': [], 'metadata': {'language_info': {'name': None}}}
+    with open(fake_nb_path, 'wt', encoding='utf8') as fh:
+        json.dump(content, fh)
+
+    nb = Notebook(fake_nb_path, {"highlighter": " minted "})
+    assert nb.config_options == {"highlighter": "minted"}
+
+
+def test_configvalidation_highlighter_bad():
+    with pytest.raises(ValueError):
+        Notebook("boguspath", {"highlighter": "vim"})
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("image/png", ["image/png"]),
+    ("image/png,image/svg+xml", ["image/png", "image/svg+xml"]),
+    (" image/png, application/pdf ", ["image/png", "application/pdf"]),
+    ("", None),
+])
+def test_configvalidation_mimetype_priority(tmp_path, value, expected):
+    fake_nb_path = tmp_path / "fake.ipynb"
+    content = {'cells': [], 'metadata': {'language_info': {'name': None}}}
+    with open(fake_nb_path, 'wt', encoding='utf8') as fh:
+        json.dump(content, fh)
+
+    nb = Notebook(fake_nb_path, {"mimetype-priority": value})
+    assert nb.config_options == {"mimetype-priority": expected}
+
+
+def test_configvalidation_mimetype_priority_bad():
+    with pytest.raises(ValueError):
+        Notebook("boguspath", {"mimetype-priority": "image/png,image/gif"})
+
+
+def test_configvalidation_svg_converter_bad():
+    with pytest.raises(ValueError):
+        Notebook("boguspath", {"svg-converter": "magick"})
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1", 1),
+    ("95", 95),
+    ("", None),
+])
+def test_configvalidation_jpeg_quality(tmp_path, value, expected):
+    fake_nb_path = tmp_path / "fake.ipynb"
+    content = {'cells': [], 'metadata': {'language_info': {'name': None}}}
+    with open(fake_nb_path, 'wt', encoding='utf8') as fh:
+        json.dump(content, fh)
+
+    nb = Notebook(fake_nb_path, {"image-jpeg-quality": value})
+    assert nb.config_options == {"image-jpeg-quality": expected}
+
+
+@pytest.mark.parametrize("value", [
+    "abc",  # not int
+    "0",  # zero
+    "96",  # over the maximum
+])
+def test_configvalidation_jpeg_quality_bad(value):
+    with pytest.raises(ValueError):
+        Notebook("boguspath", {"image-jpeg-quality": value})
+
+
 def test_source_code_single_line(notebook):
     rawcell = {
         'cell_type': 'code',
@@ -582,3 +1498,386 @@ def test_source_code_single_line(notebook):
         \\end{footnotesize}
     """).strip()
     assert src == expected
+
+
+@pytest.fixture
+def big_notebook(monkeypatch, tmp_path):
+    """Write a notebook that is considered big (so its index is used)."""
+    monkeypatch.setattr(jupynotex, "PARSED_CACHE_MIN_SIZE", 0)
+    path = tmp_path / "big.ipynb"
+    cells = [
+        {'cell_type': 'markdown', 'source': ['# title']},
+        {
+            'cell_type': 'code',
+            'source': ['print("hello")'],
+            'outputs': [{'output_type': 'stream', 'text': ['hello "world" {}[]:']}],
+        },
+        {'cell_type': 'code', 'source': ['pass']},
+        {
+            'cell_type': 'code',
+            'source': 'x',
+            'outputs': [
+                {
+                    'output_type': 'execute_result',
+                    'data': {'text/plain': ['áé \\ ñ']},
+                    'metadata': {'outputs': []},
+                },
+            ],
+        },
+    ]
+    content = {'cells': cells, 'metadata': {'language_info': {'name': None}}, 'nbformat': 4}
+    path.write_text(json.dumps(content, indent=1), encoding='utf8')
+    return path
+
+
+def test_index_same_rendering(big_notebook, monkeypatch):
+    nb = Notebook(big_notebook, {})
+    assert len(nb._cells) == 3
+    indexed = [nb.get(idx) for idx in range(1, 4)]
+
+    monkeypatch.setattr(jupynotex, "PARSED_CACHE_MIN_SIZE", 1024 ** 3)
+    nb = Notebook(big_notebook, {})
+    assert indexed == [nb.get(idx) for idx in range(1, 4)]
+
+
+def test_index_outputs_not_decoded(big_notebook):
+    nb = Notebook(big_notebook, {})
+    assert all('outputs' not in cell for cell in nb._cells)
+
+
+def test_index_reused(big_notebook):
+    Notebook(big_notebook, {})
+    with patch.object(jupynotex, "_scan_notebook") as scan_mock:
+        nb = Notebook(big_notebook, {})
+    assert scan_mock.call_count == 0
+    assert len(nb._cells) == 3
+
+
+def test_index_reused_if_touched(big_notebook):
+    Notebook(big_notebook, {})
+    stat = big_notebook.stat()
+    os.utime(big_notebook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    with patch.object(jupynotex, "_scan_notebook") as scan_mock:
+        Notebook(big_notebook, {})
+    assert scan_mock.call_count == 0
+
+
+def test_index_touched_readonly_cache(big_notebook, monkeypatch, capsys):
+    Notebook(big_notebook, {})
+    stat = big_notebook.stat()
+    os.utime(big_notebook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    def _readonly(path, text):
+        raise PermissionError("read only")
+
+    monkeypatch.setattr(jupynotex, "_write_text_atomically", _readonly)
+    nb = Notebook(big_notebook, {})
+    assert len(nb._cells) == 3
+    assert "could not save the notebook index" in capsys.readouterr().err
+
+
+def test_index_written_atomically(big_notebook, isolated_cache):
+    Notebook(big_notebook, {})
+    stat = big_notebook.stat()
+    os.utime(big_notebook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    with patch("os.replace", wraps=os.replace) as replace_mock:
+        Notebook(big_notebook, {})
+    (_, index_path), _ = replace_mock.call_args
+    assert index_path.name.endswith(".index.json")
+    assert not list(isolated_cache.glob("*/*.tmp"))
+
+
+def test_rendercache_written_atomically(notebook, isolated_cache):
+    nb = notebook([_text_cell("one")])
+    with patch("os.replace", wraps=os.replace) as replace_mock:
+        nb.get(1)
+    (_, entry_path), _ = replace_mock.call_args
+    assert entry_path.name.endswith(".cell.json")
+    assert not list(isolated_cache.glob("*/*.tmp"))
+
+
+def test_index_rebuilt_if_changed(big_notebook):
+    Notebook(big_notebook, {})
+
+    # same size, but different content
+    stat = big_notebook.stat()
+    content = big_notebook.read_text(encoding='utf8').replace('hello', 'HELLO')
+    big_notebook.write_text(content, encoding='utf8')
+    os.utime(big_notebook, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    nb = Notebook(big_notebook, {})
+    src, out = nb.get(1)
+    assert 'HELLO' in src
+    assert 'HELLO' in out
+
+
+def test_index_rendercache_one_cell_changed(big_notebook):
+    nb = Notebook(big_notebook, {})
+    first_results = [nb.get(idx) for idx in range(1, 4)]
+
+    # change the first cell's length, moving the outputs of the next ones in the file
+    content = big_notebook.read_text(encoding='utf8').replace('hello', 'hello again')
+    big_notebook.write_text(content, encoding='utf8')
+
+    nb = Notebook(big_notebook, {})
+    results = [nb.get(idx) for idx in range(1, 4)]
+    assert (nb.render_cache.hits, nb.render_cache.misses) == (2, 1)
+    assert 'hello again' in results[0][1]
+    assert results[1:] == first_results[1:]
+
+
+def test_index_memory_flat(monkeypatch, tmp_path):
+    monkeypatch.setattr(jupynotex, "PARSED_CACHE_MIN_SIZE", 0)
+    big_image = base64.b64encode(b"\x00" * 3 * 1024 * 1024).decode("ascii")  # 4 MB
+    cells = [
+        {
+            'cell_type': 'code',
+            'source': [f'show_image({idx})'],
+            'outputs': [{'output_type': 'display_data', 'data': {'image/png': big_image}}],
+        } for idx in range(5)
+    ]
+    cells.append({
+        'cell_type': 'code',
+        'source': ['print("small")'],
+        'outputs': [{'output_type': 'stream', 'text': ['small']}],
+    })
+    path = tmp_path / "heavy.ipynb"
+    path.write_text(json.dumps({'cells': cells, 'metadata': {'language_info': {'name': None}}}))
+
+    tracemalloc.start()
+    try:
+        nb = Notebook(path, {})
+        src, out = nb.get(6)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert 'small' in out
+    # the notebook is 20 MB, but the images were never loaded
+    assert peak < 1024 * 1024
+
+
+def _text_cell(text):
+    """Build a code cell with some text as output."""
+    return {
+        'cell_type': 'code',
+        'source': [f'print({text!r})'],
+        'outputs': [{'output_type': 'stream', 'text': [text]}],
+    }
+
+
+def test_rendercache_hits_and_misses(tmp_path):
+    path = tmp_path / "test.ipynb"
+    content = {
+        'cells': [_text_cell("one"), _text_cell("two"), _text_cell("three")],
+        'metadata': {'language_info': {'name': None}},
+    }
+    path.write_text(json.dumps(content))
+
+    nb = Notebook(path, {})
+    first_results = [nb.get(idx) for idx in range(1, 4)]
+    assert (nb.render_cache.hits, nb.render_cache.misses) == (0, 3)
+
+    # all reused
+    nb = Notebook(path, {})
+    assert [nb.get(idx) for idx in range(1, 4)] == first_results
+    assert (nb.render_cache.hits, nb.render_cache.misses) == (3, 0)
+
+    # change a cell, only that one is rendered again
+    content['cells'][1] = _text_cell("changed")
+    path.write_text(json.dumps(content))
+    nb = Notebook(path, {})
+    with patch.object(Notebook, "_proc_src", side_effect=Notebook._proc_src, autospec=True) as m:
+        results = [nb.get(idx) for idx in range(1, 4)]
+    assert m.call_count == 1
+    assert (nb.render_cache.hits, nb.render_cache.misses) == (2, 1)
+    assert 'changed' in results[1][1]
+
+
+def test_rendercache_options_affect(tmp_path):
+    path = tmp_path / "test.ipynb"
+    content = {
+        'cells': [_text_cell("some long text here")],
+        'metadata': {'language_info': {'name': None}},
+    }
+    path.write_text(json.dumps(content))
+
+    Notebook(path, {}).get(1)
+
+    nb = Notebook(path, {"output-text-limit": "5"})
+    _, out = nb.get(1)
+    assert nb.render_cache.misses == 1
+    assert WRAP_MARK in out
+
+    nb = Notebook(path, {})
+    nb.parse_cells("1, output-image-size=3mm")
+    nb.get(1)
+    assert nb.render_cache.misses == 1
+
+
+def test_rendercache_image_missing(tmp_path):
+    path = tmp_path / "test.ipynb"
+    rawcell = {
+        'cell_type': 'code',
+        'source': [],
+        'outputs': [
+            {
+                'output_type': 'display_data',
+                'data': {'image/png': base64.b64encode(b"image content").decode('ascii')},
+            },
+        ],
+    }
+    content = {'cells': [rawcell], 'metadata': {'language_info': {'name': None}}}
+    path.write_text(json.dumps(content))
+
+    _, out = Notebook(path, {}).get(1)
+    (fpath,) = re.match(r'\\includegraphics\[width=1\\textwidth\]\{(.+)\}', out).groups()
+    os.unlink(fpath)
+
+    nb = Notebook(path, {})
+    nb.get(1)
+    assert nb.render_cache.misses == 1
+    assert pathlib.Path(fpath).read_bytes() == b"image content"
+
+
+def _fill_cache(cache, sizes):
+    """Put artifacts of those sizes in the cache, each one used later than the previous."""
+    paths = []
+    for idx, size in enumerate(sizes):
+        path = cache.path_for(cache.build_key(str(idx)), '.bin')
+        path.write_bytes(b"x" * size)
+        os.utime(path, (1000 + idx, 1000 + idx))
+        paths.append(path)
+    return paths
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1234", 1234),
+    ("10K", 10 * 1024),
+    ("1.5m", 1536 * 1024),
+    ("2GB", 2 * 1024 ** 3),
+    ("0", 0),
+])
+def test_parse_size(text, expected):
+    assert jupynotex._parse_size(text) == expected
+
+
+@pytest.mark.parametrize("size, expected", [
+    (123, "123 B"),
+    (1536, "1.5 KB"),
+    (3 * 1024 ** 3, "3.0 GB"),
+])
+def test_format_size(size, expected):
+    assert jupynotex._format_size(size) == expected
+
+
+def test_diskcache_prune_lru(isolated_cache):
+    cache = jupynotex.DiskCache(isolated_cache)
+    paths = _fill_cache(cache, [100, 100, 100, 100])
+    cache.touch(paths[0])  # now the most recently used
+
+    assert cache.prune(1000) == (0, 0)
+    assert cache.prune(300, 200) == (2, 200)
+    assert [path.exists() for path in paths] == [True, False, False, True]
+
+
+def test_diskcache_prune_empty(tmp_path):
+    cache = jupynotex.DiskCache(tmp_path / "missing")
+    assert cache.prune(0) == (0, 0)
+
+
+def test_rendercache_hit_touches(tmp_path, isolated_cache):
+    path = tmp_path / "test.ipynb"
+    content = {'cells': [_text_cell("one")], 'metadata': {'language_info': {'name': None}}}
+    path.write_text(json.dumps(content))
+    Notebook(path, {}).get(1)
+
+    (entry,) = isolated_cache.glob("*/*.cell.json")
+    os.utime(entry, (1000, 1000))
+    Notebook(path, {}).get(1)
+    assert entry.stat().st_mtime > 1000
+
+
+def test_main_records_stats_and_prunes(tmp_path, isolated_cache, monkeypatch, capsys):
+    path = tmp_path / "test.ipynb"
+    content = {
+        'cells': [_text_cell("one"), _text_cell("two")],
+        'metadata': {'language_info': {'name': None}},
+    }
+    path.write_text(json.dumps(content))
+    old_paths = _fill_cache(jupynotex.DiskCache(isolated_cache), [3000, 3000])
+    monkeypatch.setenv("JUPYNOTEX_CACHE_MAX_SIZE", "5K")
+
+    jupynotex.main(path, "1-2", {})
+    jupynotex.main(path, "1-2", {})
+    assert jupynotex.DiskCache(isolated_cache).stats() == {"hits": 2, "misses": 2}
+
+    # the oldest artifact was removed to make room for the new ones
+    assert [path.exists() for path in old_paths] == [False, True]
+    assert len(list(isolated_cache.glob("*/*.cell.json"))) == 2
+
+
+def test_main_scans_cache_only_if_needed(tmp_path, isolated_cache, monkeypatch, capsys):
+    path = tmp_path / "test.ipynb"
+    content = {'cells': [_text_cell("one")], 'metadata': {'language_info': {'name': None}}}
+    path.write_text(json.dumps(content))
+    monkeypatch.setenv("JUPYNOTEX_CACHE_MAX_SIZE", "1M")
+
+    # the first time the size is not known
+    with patch.object(jupynotex.DiskCache, "artifacts", autospec=True, return_value=[]) as m:
+        jupynotex.main(path, "1", {})
+    assert m.call_count == 1
+
+    # a cell is rendered again: the added size is accounted, without scanning the cache
+    content['cells'] = [_text_cell("changed")]
+    path.write_text(json.dumps(content))
+    with patch.object(jupynotex.DiskCache, "artifacts", autospec=True, return_value=[]) as m:
+        jupynotex.main(path, "1", {})
+    assert m.call_count == 0
+    (entry,) = [
+        path for path in isolated_cache.glob("*/*.cell.json") if b"changed" in path.read_bytes()]
+    stats = json.loads((isolated_cache / "stats.json").read_text())
+    assert stats["size"] == entry.stat().st_size
+
+    # it's scanned if the size exceeds the maximum
+    monkeypatch.setenv("JUPYNOTEX_CACHE_MAX_SIZE", "10")
+    content['cells'] = [_text_cell("changed again")]
+    path.write_text(json.dumps(content))
+    with patch.object(jupynotex.DiskCache, "artifacts", autospec=True, return_value=[]) as m:
+        jupynotex.main(path, "1", {})
+    assert m.call_count == 1
+
+
+def test_diskcache_prune_readonly(isolated_cache):
+    cache = jupynotex.DiskCache(isolated_cache)
+    paths = _fill_cache(cache, [100, 100])
+
+    with patch("os.unlink", side_effect=PermissionError("read only")):
+        assert cache.prune(0) == (0, 0)
+    assert all(path.exists() for path in paths)
+
+
+def test_cache_cmdline_stats(isolated_cache, capsys):
+    cache = jupynotex.DiskCache(isolated_cache)
+    _fill_cache(cache, [1024, 512])
+    cache.record_stats(3, 1)
+
+    jupynotex._cache_cmdline(["stats"])
+    assert capsys.readouterr().out.splitlines() == [
+        f"Directory: {isolated_cache}",
+        "Entries: 2",
+        "Size: 1.5 KB (max 1.0 GB)",
+        "Rendered cells: 3 hits, 1 misses (hit rate 75.0%)",
+    ]
+
+
+def test_cache_cmdline_prune(isolated_cache, capsys):
+    paths = _fill_cache(jupynotex.DiskCache(isolated_cache), [1024, 1024, 1024])
+
+    jupynotex._cache_cmdline(["prune", "--max-size", "1K"])
+    assert capsys.readouterr().out == "Removed 2 entries (2.0 KB)\n"
+    assert [path.exists() for path in paths] == [False, False, True]
+
+    jupynotex._cache_cmdline(["prune", "--max-size", "0"])
+    assert capsys.readouterr().out == "Removed 1 entries (1.0 KB)\n"
@@ -0,0 +1,183 @@
+# Copyright 2025 Facundo Batista
+# All Rights Reserved
+# Licensed under Apache 2.0
+
+import base64
+import hashlib
+import json
+import pathlib
+import textwrap
+from unittest.mock import patch
+
+import pytest
+
+import jupynotex
+from jupynotex import find_jupynotex_calls, fragment_name, fragment_stamp, main, precompile
+
+
+@pytest.fixture
+def project(monkeypatch, tmp_path):
+    """A directory to run the precompilation, with a notebook in it."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(jupynotex, 'FORMAT_OK', 'testformat')
+
+    cells = []
+    for idx in range(1, 4):
+        cells.append({
+            'cell_type': 'code',
+            'source': [f'print({idx})'],
+            'outputs': [{'output_type': 'stream', 'text': [str(idx)]}],
+        })
+    fake_nb = {'cells': cells, 'metadata': {'language_info': {'name': None}}}
+    (tmp_path / "test.ipynb").write_text(json.dumps(fake_nb))
+    return tmp_path
+
+
+def test_find_calls_simple():
+    tex = textwrap.dedent(r"""
+        \jupynotex{foo.ipynb}
+        Some text \jupynotex[1,3-4]{bar.ipynb} more text.
+        \jupynotex[ 2i,  output-image-size=70mm ]{dir/baz.ipynb}
+    """)
+    assert find_jupynotex_calls(tex) == [
+        ("foo.ipynb", "-"),
+        ("bar.ipynb", "1,3-4"),
+        ("dir/baz.ipynb", " 2i, output-image-size=70mm "),
+    ]
+
+
+def test_find_calls_ignore_comments():
+    tex = textwrap.dedent(r"""
+        % \jupynotex{foo.ipynb}
+        \jupynotex[2]{bar.ipynb}  % \jupynotex[3]{bar.ipynb}
+        Discount of 50\% \jupynotex[4]{bar.ipynb}
+    """)
+    assert find_jupynotex_calls(tex) == [("bar.ipynb", "2"), ("bar.ipynb", "4")]
+
+
+def test_find_calls_not_other_macros():
+    tex = r"\jupynotexfoo{foo.ipynb} \newcommand{\jupynotex}[2][-]{whatever}"
+    assert find_jupynotex_calls(tex) == []
+
+
+def test_fragment_name():
+    # same as TeX's \pdf@mdfivesum{foo.ipynb|1-3}
+    expected = hashlib.md5(b"foo.ipynb|1-3").hexdigest().upper()
+    assert fragment_name("foo.ipynb", "1-3") == expected
+
+
+def test_fragment_stamp(tmp_path):
+    notebook_path = tmp_path / "foo.ipynb"
+    notebook_path.write_bytes(b"notebook content")
+    stamp = fragment_stamp(notebook_path, {"output-text-limit": "80", "svg-workers": "2"})
+
+    file_md5, options_md5 = stamp.split("/")
+    assert file_md5 == hashlib.md5(b"notebook content").hexdigest().upper()
+    assert options_md5 == hashlib.md5(b"80||||2||||||||||").hexdigest().upper()
+
+
+def test_fragment_stamp_chunked(tmp_path):
+    notebook_path = tmp_path / "foo.ipynb"
+    content = b"notebook content " * 100_000
+    notebook_path.write_bytes(content)
+    with patch("pathlib.Path.read_bytes", side_effect=ValueError("not loaded whole")):
+        stamp = fragment_stamp(notebook_path, {})
+    assert stamp.split("/")[0] == hashlib.md5(content).hexdigest().upper()
+
+
+def test_precompile_renders_fragments(project, capsys):
+    tex_path = project / "doc.tex"
+    tex_path.write_text("\\jupynotex[1-2]{test.ipynb}\n\\jupynotex[3o]{test.ipynb}\n")
+
+    problems = precompile([tex_path], {}, workers=1)
+    assert problems == []
+
+    for cells_spec in ("1-2", "3o"):
+        basepath = project / "jupynotex-fragments" / fragment_name("test.ipynb", cells_spec)
+
+        # same content than rendering through the normal path
+        main(project / "test.ipynb", cells_spec, {})
+        assert basepath.with_suffix(".tex").read_text() == capsys.readouterr().out
+
+        stamp = fragment_stamp(project / "test.ipynb", {})
+        assert stamp in basepath.with_suffix(".stamp").read_text()
+
+
+def test_precompile_problems(project):
+    tex_path = project / "doc.tex"
+    tex_path.write_text("\\jupynotex[1,x]{test.ipynb}\n\\jupynotex{missing.ipynb}\n")
+
+    problems = precompile([tex_path], {}, workers=2)
+    assert len(problems) == 2
+    assert problems[0].startswith("test.ipynb [1,x]: ValueError")
+    assert problems[1].startswith("missing.ipynb: FileNotFoundError")
+
+    # no fragments produced, so LaTeX will render them normally
+    assert list((project / "jupynotex-fragments").iterdir()) == []
+
+
+def _add_image_cell(project):
+    notebook_path = project / "test.ipynb"
+    content = json.loads(notebook_path.read_text())
+    content['cells'].append({
+        'cell_type': 'code',
+        'source': ['plot()'],
+        'outputs': [{
+            'output_type': 'display_data',
+            'data': {'image/png': base64.b64encode(b"image content").decode('ascii')},
+        }],
+    })
+    notebook_path.write_text(json.dumps(content))
+    image_name = hashlib.sha256(b"image content").hexdigest() + ".png"
+    return str(pathlib.Path(jupynotex.DEFAULT_IMAGE_DIR) / image_name)
+
+
+def test_dependency_file_from_render(project, capsys):
+    image_path = _add_image_cell(project)
+    config = {"dependency-file": "doc.d"}
+
+    main(pathlib.Path("test.ipynb"), "1-2", dict(config))
+    main(pathlib.Path("test.ipynb"), "4", dict(config))
+    main(pathlib.Path("test.ipynb"), "4", dict(config))  # the same call again, now cached
+
+    assert (project / "doc.d").read_text() == textwrap.dedent(f"""\
+        # the notebooks and images used by jupynotex, updated on each run
+        doc.pdf: test.ipynb  # jupynotex call: test.ipynb [1-2]
+        doc.pdf: test.ipynb {image_path}  # jupynotex call: test.ipynb [4]
+
+        test.ipynb:
+        {image_path}:
+    """)
+
+
+def test_dependency_file_escaped(project, capsys):
+    (project / "the test.ipynb").write_text((project / "test.ipynb").read_text())
+
+    main(pathlib.Path("the test.ipynb"), "1", {"dependency-file": "doc$.d"})
+    assert (project / "doc$.d").read_text() == textwrap.dedent("""\
+        # the notebooks and images used by jupynotex, updated on each run
+        doc$$.pdf: the\\ test.ipynb  # jupynotex call: the test.ipynb [1]
+
+        the\\ test.ipynb:
+    """)
+
+
+def test_dependency_file_from_precompile(project):
+    image_path = _add_image_cell(project)
+    (project / "doc.tex").write_text("\\jupynotex[1]{test.ipynb}\n\\jupynotex[4]{test.ipynb}\n")
+    (project / "other.tex").write_text(
+        "\\jupynotex[2]{test.ipynb}\n\\jupynotex[1,x]{test.ipynb}\n")
+
+    problems = precompile(
+        [pathlib.Path("doc.tex"), pathlib.Path("other.tex")], {"dependency-file": "deps.d"})
+    assert len(problems) == 1
+
+    assert (project / "deps.d").read_text() == textwrap.dedent(f"""\
+        # the notebooks and images used by jupynotex, updated on each run
+        doc.pdf: test.ipynb  # jupynotex call: test.ipynb [1]
+        doc.pdf: test.ipynb {image_path}  # jupynotex call: test.ipynb [4]
+        other.pdf: test.ipynb  # jupynotex call: test.ipynb [2]
+
+        test.ipynb:
+        {image_path}:
+    """)